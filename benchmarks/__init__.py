@@ -0,0 +1,6 @@
+# -*- coding: utf-8 -*-
+
+# benchmarks
+#
+# timing scripts for the lego collection pipeline, run from the base
+# directory as python -m benchmarks.<script>
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+
+# bench_fetch.py
+#
+# times Rebrickable.fetch_main_shelves end to end against the local stand-in
+# server (see rebrickable_server.py), fully offline
+#
+#   python -m benchmarks.bench_fetch [--sets 100] [--latency 0.05]
+#                                    [--page-size 100] [--throttle 0]
+#                                    [--errors 0.0] [--workers 4]
+#                                    [--rate 1000]
+
+import os
+import time
+import shutil
+import argparse
+import tempfile
+
+import lego as lg
+import lego_conf as lconf
+import rebrickable as rb
+
+from benchmarks import rebrickable_server
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Times fetch_main_shelves '
+                                     'against a local Rebrickable stand-in')
+    parser.add_argument('--sets', type=int, default=100)
+    parser.add_argument('--parts', type=int, default=2000)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--page-size', type=int, default=1000)
+    parser.add_argument('--throttle', type=int, default=0)
+    parser.add_argument('--retry-after', type=int, default=0)
+    parser.add_argument('--errors', type=float, default=0.0)
+    parser.add_argument('--workers', type=int, default=lconf.fetch_workers)
+    parser.add_argument('--rate', type=float, default=1000.0,
+                        help='requests per second of the limiter')
+    parser.add_argument('--backoff', type=float, default=0.01,
+                        help='seconds before the first retry')
+    args = parser.parse_args()
+
+    lg.debug = 0
+    rb.debug = 0
+    lconf.fetch_workers = args.workers
+    lconf.retry_backoff = args.backoff
+    rb.limiter = rb.TokenBucket(args.rate, max(1, args.workers))
+
+    server = rebrickable_server.serve(
+            rebrickable_server.Fixtures(args.sets, args.parts),
+            latency=args.latency, page_size=args.page_size,
+            throttle=args.throttle, retry_after=args.retry_after,
+            errors=args.errors)
+
+    base_dir = os.getcwd()
+    tmp = tempfile.mkdtemp()
+    try:
+        os.chdir(tmp)   # the shelves and the cache are created in ./shelves
+        reb = rb.Rebrickable(base_url=server.base_url)
+        start = time.perf_counter()
+        reb.fetch_main_shelves()
+        elapsed = time.perf_counter() - start
+
+        lss = lg.LegoSetShelf()
+        les = lg.LegoElementShelf()
+        print ('sets: %d/%d  elements: %d  server requests: %d' %
+               (len(lss), args.sets, len(les), server.requests))
+        print ('fetch_main_shelves: %.2f s' % elapsed)
+        reb.print_stats()
+        lss.close()
+        les.close()
+    finally:
+        os.chdir(base_dir)
+        shutil.rmtree(tmp, ignore_errors=True)
+        server.shutdown()
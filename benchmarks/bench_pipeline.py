@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+
+# bench_pipeline.py
+#
+# times the stages of the pipeline on synthetic collections (see
+# synthetic.py) at several scales, and saves the timings as a JSON baseline
+# or compares them against one
+#
+#   python -m benchmarks.bench_pipeline [--scales small,medium]
+#                                       [--save baseline.json]
+#                                       [--compare baseline.json]
+#                                       [--tolerance 1.25] [--jobs n]
+#
+# the run fails (exit status 1) when a stage is slower than tolerance times
+# its baseline timing
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+
+import lego as lg
+import lego_collection as lcm
+import lego_conf as lconf
+
+from benchmarks import synthetic
+
+
+# scale : (num_sets, num_parts, num_colours)
+
+scales = {'small': (100, 1000, 30),
+          'medium': (400, 3000, 60),
+          'large': (1600, 8000, 120)}
+
+
+def best_of(f, repeat=3):
+    '''
+    # returns the best time of repeat calls to f and the result of the last
+    '''
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = f()
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def fresh_html(lc, param, jobs):
+    '''
+    # build_html of every page, as after a change of every record
+    '''
+    html_dir = lconf.set_html_dir if param == 'sets' else lconf.box_html_dir
+    manifest = html_dir + lconf.html_manifest_file
+    if os.path.isfile(manifest):
+        os.unlink(manifest)
+    lc.build_html(param, jobs)
+
+
+def bench_scale(num_sets, num_parts, num_colours, jobs=1, repeat=3):
+    '''
+    # generates a collection in a temporary directory and returns a
+    # dictionary <stage : best time in seconds>
+    '''
+    results = {}
+    base_dir = os.getcwd()
+    tmp = tempfile.mkdtemp()
+    try:
+        os.chdir(tmp)
+        results['generate'], _ = best_of(
+                lambda: synthetic.generate(num_sets, num_parts, num_colours),
+                1)
+
+        lc = lcm.LegoCollection()
+        for name in ('lcs', 'lts', 'lpcs', 'lps', 'les', 'lss', 'lbs'):
+            shelf = getattr(lc, name)
+            results['get_dataframe.' + type(shelf).__name__], _ = \
+                best_of(shelf.get_dataframe, repeat)
+
+        results['merge_collection'], df = best_of(lc.merge_collection, repeat)
+        results['merge_collection.rows'] = len(df)
+
+        results['LegoPartShelf.fetch_boxes'], _ = \
+            best_of(lc.lps.fetch_boxes, repeat)
+
+        results['buildability'], _ = best_of(
+                lambda: lc.buildability().completion(), repeat)
+
+        for param in ('sets', 'boxes'):
+            results['build_html.%s' % param], _ = \
+                best_of(lambda: fresh_html(lc, param, jobs), repeat)
+            results['build_html.%s.unchanged' % param], _ = \
+                best_of(lambda: lc.build_html(param, jobs), repeat)
+        lc.close_shelves()
+    finally:
+        os.chdir(base_dir)
+        shutil.rmtree(tmp, ignore_errors=True)
+    return results
+
+
+def compare(results, baseline, tolerance):
+    '''
+    # prints the timings against the baseline and returns the list of
+    # (scale, stage) slower than tolerance times their baseline
+    '''
+    regressions = []
+    for scale, stages in results.items():
+        base = baseline.get('results', {}).get(scale, {})
+        for stage, t in sorted(stages.items()):
+            if stage.endswith('.rows') or stage not in base:
+                continue
+            ratio = t / base[stage] if base[stage] else 1.0
+            flag = ''
+            if ratio > tolerance:
+                flag = '  REGRESSION'
+                regressions.append((scale, stage))
+            print ('%-8s %-40s %8.3f s %8.3f s %6.2fx%s' %
+                   (scale, stage, base[stage], t, ratio, flag))
+    return regressions
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Times the pipeline on '
+                                     'synthetic collections')
+    parser.add_argument('--scales', default='small,medium',
+                        help='comma separated list of ' +
+                        ', '.join(scales.keys()))
+    parser.add_argument('--save', help='JSON file to save the timings to')
+    parser.add_argument('--compare', help='JSON baseline to compare with')
+    parser.add_argument('--tolerance', type=float, default=1.25)
+    parser.add_argument('--jobs', type=int, default=1)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    lg.debug = 0
+    lcm.debug = 0
+
+    results = {}
+    for scale in args.scales.split(','):
+        start = time.perf_counter()
+        results[scale] = bench_scale(*scales[scale], jobs=args.jobs,
+                                     repeat=args.repeat)
+        print ('%s %s: %.1f s' % (scale, scales[scale],
+                                  time.perf_counter() - start))
+        for stage, t in sorted(results[scale].items()):
+            print ('   %-40s %10.3f' % (stage, t))
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'python': platform.python_version(),
+                       'machine': platform.machine(),
+                       'scales': {s: scales[s] for s in results.keys()},
+                       'results': results}, f, indent=1, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.tolerance):
+            sys.exit(1)
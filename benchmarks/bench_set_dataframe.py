@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+
+# bench_set_dataframe.py
+#
+# times LegoSetShelf.get_dataframe against the previous implementation on
+# a synthetic collection of a few thousand sets
+#
+#   python -m benchmarks.bench_set_dataframe [num_sets]
+
+import os
+import sys
+import tempfile
+
+import pandas as pd
+
+import lego as lg
+
+from benchmarks.synthetic import fill_set_shelf
+from benchmarks.bench_pipeline import best_of
+
+
+def get_dataframe_reference(lss):
+    '''
+    # LegoSetShelf.get_dataframe before it was vectorised
+    '''
+    num_list = []
+    name_list = []
+    year_list = []
+    theme_id_list = []
+    num_parts_list = []
+    img_url_list = []
+    local_img_url_list = []
+    url_list = []
+    element_id_list = []
+    element_quantity_list = []
+    set_quantity_list = []
+    
+    for ls in lss.keys():
+        n = len(lss[ls].get_elements())
+        num_list += [lss[ls].get_num()]*n
+        name_list += [lss[ls].get_name()]*n
+        year_list += [lss[ls].get_year()]*n
+        theme_id_list += [lss[ls].get_theme_id()]*n
+        num_parts_list += [lss[ls].get_num_parts()]*n
+        img_url_list += [lss[ls].get_img_url()]*n
+        local_img_url_list += [lss[ls].get_local_img_url()]*n
+        url_list += [lss[ls].get_url()]*n
+        set_quantity_list += [lss[ls].get_quantity()]*n
+        for el in lss[ls].get_elements().keys():
+            element_id_list.append(el)
+            element_quantity_list.append(lss[ls].get_elements()[el])
+        
+    data = {'set_num':num_list,
+           'set_name':name_list,
+           'set_year': year_list,
+           'set_theme_id': theme_id_list,
+           'set_num_parts': num_parts_list,
+           'set_img_url': img_url_list,
+           'set_local_img_url': local_img_url_list,
+           'set_url': url_list,
+           'set_quantity': set_quantity_list,
+           'set_element_id': element_id_list,
+           'set_element_quantity': element_quantity_list}     
+   
+    df = pd.DataFrame(data)
+    df = df.astype(str)
+    df[["set_quantity", "set_element_quantity", "set_num_parts"]] = \
+        df[["set_quantity", "set_element_quantity", \
+            "set_num_parts"]].astype(int)
+    return (df)     
+
+
+def declared_dtypes(df, lss):
+    '''
+    # df (a reference dataframe, all strings and ints) with the dtypes 
+    # LegoSetShelf.get_dataframe declares: those of lss.dtypes() and int64
+    # element ids and quantities
+    '''
+    dtypes = {'set_' + c : t for c, t in lss.dtypes().items()}
+    dtypes.update({'set_element_id': 'int64', 
+                   'set_element_quantity': 'int64'})
+    for c, t in dtypes.items():
+        if t in ('Int64', 'int64'):
+            df[c] = df[c].astype('int64').astype(t)
+        else:
+            df[c] = df[c].astype(t)
+    return df
+
+
+if __name__ == '__main__':
+
+    num_sets = int(sys.argv[1]) if len(sys.argv) > 1 else 3000
+    base_dir = os.getcwd()
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)   # the shelves are created in ./shelves
+        lss = lg.LegoSetShelf()
+        fill_set_shelf(lss, num_sets)
+        
+        t_ref, df_ref = best_of(lambda: get_dataframe_reference(lss))
+        t_new, df_new = best_of(lss.get_dataframe)
+        pd.testing.assert_frame_equal(declared_dtypes(df_ref, lss), df_new)
+        
+        print ('sets: %d  rows: %d' % (num_sets, len(df_new)))
+        print ('reference  : %.3f s' % t_ref)
+        print ('vectorised : %.3f s' % t_new)
+        print ('speedup    : %.1fx' % (t_ref / t_new))
+        lss.close()
+        os.chdir(base_dir)
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+
+# bench_startup.py
+#
+# measures the import time of the entry modules with python -X importtime,
+# in a fresh interpreter each time, and fails (exit status 1) when one takes
+# longer than the budget or imports one of the heavy modules that the menus
+# should only load on the options that need them
+#
+#   python -m benchmarks.bench_startup [--modules lego_collection,lego]
+#                                      [--budget 100] [--repeat 5] [--top 10]
+
+import sys
+import argparse
+import subprocess
+
+
+heavy_modules = ('pandas', 'numpy', 'jinja2', 'requests', 'pyarrow')
+
+
+def import_times(module):
+    '''
+    # imports module in a new interpreter and returns the list of
+    # (cumulative microseconds, self microseconds, name) of the imports it
+    # made, ending with its own, and the heavy modules it loaded
+    '''
+    code = ('import sys, %s; print(" ".join(m for m in %r if m in '
+            'sys.modules))' % (module, heavy_modules))
+    p = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                       capture_output=True, text=True, check=True)
+    times = []
+    for line in p.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        times.append((int(cumulative_us), int(self_us), name.rstrip()))
+    # the imports of module are the lines before its own one that are 
+    # indented deeper (-X importtime lists the children first)
+    end = next(i for i, t in enumerate(times) if t[2].strip() == module)
+    depth = len(times[end][2]) - len(times[end][2].lstrip())
+    start = end
+    while start > 0 and len(times[start - 1][2]) - \
+            len(times[start - 1][2].lstrip()) > depth:
+        start -= 1
+    return times[start:end + 1], p.stdout.split()
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Import time budget of the '
+                                     'entry modules')
+    parser.add_argument('--modules', default='lego_collection,lego')
+    parser.add_argument('--budget', type=float, default=100.0,
+                        help='milliseconds per module')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--top', type=int, default=10,
+                        help='slowest imports listed')
+    args = parser.parse_args()
+
+    failed = False
+    for module in args.modules.split(','):
+        best = None
+        for _ in range(args.repeat):
+            times, heavy = import_times(module)
+            total = times[-1][0]
+            if best is None or total < best[0]:
+                best = (total, times, heavy)
+        total, times, heavy = best
+
+        status = 'ok'
+        if total / 1000 > args.budget:
+            status = 'OVER BUDGET'
+            failed = True
+        if heavy:
+            status += ', imports ' + ', '.join(heavy)
+            failed = True
+        print ('%-20s %8.1f ms (budget %.0f ms) %s' %
+               (module, total / 1000, args.budget, status))
+        for cumulative_us, self_us, name in sorted(times,
+                                                   reverse=True)[:args.top]:
+            print ('   %-40s %8.1f ms %8.1f ms' %
+                   (name, cumulative_us / 1000, self_us / 1000))
+
+    if failed:
+        sys.exit(1)
@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+
+# rebrickable_server.py
+#
+# local stand-in for the Rebrickable.com API v3 endpoints used by
+# rebrickable.py, serving synthetic fixtures, to exercise the fetch code
+# without the real API:
+#
+#   lego/colors, lego/themes, lego/part_categories,
+#   users/{user_token}/setlists/{list_id}/sets,
+#   lego/sets/{set_num} and lego/sets/{set_num}/parts
+#
+#   python -m benchmarks.rebrickable_server [--port 8000] [--sets 100]
+#                                           [--latency 0.05] [--page-size 100]
+#                                           [--throttle 20] [--errors 0.01]
+#
+# and then Rebrickable(base_url='http://127.0.0.1:8000/api/v3/')
+
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+import urllib.parse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+class Fixtures:
+    """
+    # the catalogue and the set list served, with num_sets sets of parts
+    # among num_parts in num_colours colours
+    """
+
+    def __init__(self, num_sets=100, num_parts=2000, num_colours=60,
+                 seed=0):
+        rnd = random.Random(seed)
+        self.colours = [{'id': i, 'name': 'Colour %d' % i,
+                         'rgb': '%06X' % rnd.randrange(0x1000000),
+                         'is_trans': i % 5 == 0}
+                        for i in range(num_colours)]
+        self.themes = [{'id': i, 'name': 'Theme %d' % i, 'parent_id': None}
+                       for i in range(1, 400)]
+        self.part_categories = [{'id': i, 'name': 'Category %d' % i}
+                                for i in range(1, 70)]
+        parts = [{'part_num': str(3000 + i),
+                  'name': 'Brick %d' % i,
+                  'part_cat_id': rnd.randint(1, 69),
+                  'part_url': 'https://rebrickable.com/parts/%d/' % (3000 + i),
+                  'part_img_url': 'https://cdn.rebrickable.com/media/parts/'
+                                  'ldraw/%d.png' % (3000 + i)}
+                 for i in range(num_parts)]
+        self.sets = {}
+        self.set_parts = {}
+        self.set_list = []
+        line_id = 0
+        for i in range(num_sets):
+            num = '%d-1' % (10000 + i)
+            lines = []
+            for j in range(rnd.randint(20, 300)):
+                line_id += 1
+                lines.append({'id': line_id,
+                              'inv_part_id': line_id,
+                              'part': rnd.choice(parts),
+                              'color': rnd.choice(self.colours),
+                              'quantity': rnd.randint(1, 8),
+                              'is_spare': False})
+            self.set_parts[num] = lines
+            self.sets[num] = {'set_num': num,
+                              'name': 'Set %d' % i,
+                              'year': rnd.randint(1980, 2020),
+                              'theme_id': rnd.randint(1, 399),
+                              'num_parts': len(lines),
+                              'set_url': 'https://rebrickable.com/sets/%s/'
+                                         % num,
+                              'set_img_url': 'https://cdn.rebrickable.com/'
+                                             'media/sets/%s.jpg' % num}
+            self.set_list.append({'set': {'set_num': num},
+                                  'quantity': rnd.randint(1, 2)})
+
+
+class Handler(BaseHTTPRequestHandler):
+    """
+    # serves a GET of the API; the fixtures and the behaviour are attributes
+    # of the server (see serve())
+    """
+
+    protocol_version = 'HTTP/1.1'   # keep-alive, as the real API
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+    def send_json(self, status, body, headers={}):
+        content = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        for k, v in headers.items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(content)
+
+    def send_page(self, results, query):
+        '''
+        # sends one page of results, at most server.page_size of them
+        # whatever page_size the client asks for
+        '''
+        page = int(query.get('page', ['1'])[0])
+        size = min(int(query.get('page_size', ['100'])[0]),
+                   self.server.page_size)
+        start = (page - 1) * size
+        if page < 1 or (start >= len(results) and page > 1):
+            self.send_json(404, {'detail': 'Invalid page.'})
+            return
+        url = 'http://%s:%d%s?page=%%d&page_size=%d' % (
+                self.server.server_address[0], self.server.server_address[1],
+                urllib.parse.urlsplit(self.path).path, size)
+        self.send_json(200, {
+                'count': len(results),
+                'next': url % (page + 1)
+                        if start + size < len(results) else None,
+                'previous': url % (page - 1) if page > 1 else None,
+                'results': results[start:start + size]})
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests += 1
+            n = server.requests
+        if server.latency:
+            time.sleep(server.latency)
+
+        if not self.headers.get('Authorization', '').startswith('key '):
+            self.send_json(401, {'detail': 'Invalid API key.'})
+            return
+        if server.throttle and n % server.throttle == 0:
+            self.send_json(429, {'detail': 'Request was throttled.'},
+                           {'Retry-After': str(server.retry_after)})
+            return
+        if server.errors and server.rnd.random() < server.errors:
+            self.send_json(503, {'detail': 'Service unavailable.'})
+            return
+
+        split = urllib.parse.urlsplit(self.path)
+        query = urllib.parse.parse_qs(split.query)
+        path = split.path.strip('/').split('/')
+        if path[:2] != ['api', 'v3']:
+            self.send_json(404, {'detail': 'Not found.'})
+            return
+        path = path[2:]
+        fx = server.fixtures
+
+        if path == ['lego', 'colors']:
+            self.send_page(fx.colours, query)
+        elif path == ['lego', 'themes']:
+            self.send_page(fx.themes, query)
+        elif path == ['lego', 'part_categories']:
+            self.send_page(fx.part_categories, query)
+        elif len(path) == 5 and path[0] == 'users' and \
+                path[2] == 'setlists' and path[4] == 'sets':
+            self.send_page(fx.set_list, query)
+        elif len(path) == 3 and path[:2] == ['lego', 'sets'] and \
+                path[2] in fx.sets:
+            self.send_json(200, fx.sets[path[2]])
+        elif len(path) == 4 and path[:2] == ['lego', 'sets'] and \
+                path[3] == 'parts' and path[2] in fx.set_parts:
+            self.send_page(fx.set_parts[path[2]], query)
+        else:
+            self.send_json(404, {'detail': 'Not found.'})
+
+
+def serve(fixtures, port=0, latency=0.0, page_size=1000, throttle=0,
+          retry_after=1, errors=0.0, verbose=False, seed=0):
+    '''
+    # starts the server in a daemon thread and returns it; its base URL for
+    # Rebrickable(base_url=...) is server.base_url
+    #
+    # latency     : seconds added to every response
+    # page_size   : maximum results per page
+    # throttle    : every throttle-th request gets a 429 with a Retry-After
+    #               of retry_after seconds (0 never)
+    # errors      : fraction of the requests that get a 503
+    '''
+    server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+    server.daemon_threads = True
+    server.fixtures = fixtures
+    server.latency = latency
+    server.page_size = page_size
+    server.throttle = throttle
+    server.retry_after = retry_after
+    server.errors = errors
+    server.verbose = verbose
+    server.rnd = random.Random(seed)
+    server.lock = threading.Lock()
+    server.requests = 0
+    server.base_url = 'http://127.0.0.1:%d/api/v3/' % server.server_port
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Local stand-in for the '
+                                     'Rebrickable.com API')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--sets', type=int, default=100)
+    parser.add_argument('--parts', type=int, default=2000)
+    parser.add_argument('--colours', type=int, default=60)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--page-size', type=int, default=1000)
+    parser.add_argument('--throttle', type=int, default=0)
+    parser.add_argument('--retry-after', type=int, default=1)
+    parser.add_argument('--errors', type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = serve(Fixtures(args.sets, args.parts, args.colours), args.port,
+                   args.latency, args.page_size, args.throttle,
+                   args.retry_after, args.errors, verbose=True)
+    print ('Serving', server.base_url)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        sys.exit(0)
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+
+# synthetic.py
+#
+# generates a synthetic lego collection in the current directory: the
+# shelves, part_box.csv and the html directories with the templates, so the
+# pipeline can be timed without fetching anything from Rebrickable.com
+#
+#   python -m benchmarks.synthetic <dir> [num_sets] [num_parts] [num_colours]
+
+import os
+import sys
+import time
+import shutil
+import random
+
+import lego as lg
+import lego_conf as lconf
+
+
+base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+num_themes = 400
+num_part_categories = 70
+num_boxes = 150
+
+
+def fill_set_shelf(lss, num_sets, num_parts=None, num_colours=None,
+                   les=None, seed=0):
+    '''
+    # adds num_sets sets of 20 to 300 elements each to the set shelf lss
+    #
+    # if les is given, the elements are added to it too, of random parts
+    # among the first num_parts and colours among the first num_colours
+    '''
+    rnd = random.Random(seed)
+    el_id = 0
+    with lss.batch(lconf.shelf_flush_every):
+        for i in range(num_sets):
+            num = '%d-1' % (10000 + i)
+            qty = rnd.randint(1, 2)
+            ed = {}
+            for j in range(rnd.randint(20, 300)):
+                el_id += 1
+                ed[el_id] = rnd.randint(1, 8)
+                if les is not None:
+                    part = rnd.randrange(num_parts)
+                    colour = rnd.randrange(num_colours)
+                    les[str(el_id)] = lg.LegoElement(
+                            el_id,
+                            300000 + part,
+                            str(3000 + part),
+                            colour,
+                            'https://cdn.rebrickable.com/media/parts/'
+                            'elements/%d%03d.jpg' % (3000 + part, colour),
+                            ed[el_id] * qty)
+            lss[num] = lg.LegoSet(num, 'Set %d' % i, rnd.randint(1980, 2020),
+                                  rnd.randint(1, num_themes - 1), len(ed),
+                                  'https://rebrickable.com/sets/%s/' % num,
+                                  'https://cdn.rebrickable.com/media/sets/'
+                                  '%s.jpg' % num, ed, qty)
+
+
+def generate(num_sets, num_parts, num_colours=60, seed=0):
+    '''
+    # creates the shelves of num_sets sets built from num_parts distinct
+    # parts in num_colours colours, a part_box.csv spreading the parts in
+    # num_boxes boxes (a few of them unboxed, 00 or XX) and the html
+    # directories, all under the current directory
+    '''
+    rnd = random.Random(seed)
+
+    for d in (lconf.set_html_dir, lconf.box_html_dir):
+        if not os.path.isdir(d):
+            os.makedirs(d)
+    if not os.path.isdir(lconf.jinja2_template_dir):
+        shutil.copytree(os.path.join(base_dir, lconf.jinja2_template_dir),
+                        lconf.jinja2_template_dir)
+
+    lcs = lg.LegoColourShelf()
+    with lcs.batch():
+        for i in range(num_colours):
+            lcs[str(i)] = lg.LegoColour(i, 'Colour %d' % i,
+                                        '%06X' % rnd.randrange(0x1000000),
+                                        i % 5 == 0)
+    lcs.close()
+
+    lts = lg.LegoThemeShelf()
+    with lts.batch():
+        for i in range(1, num_themes):
+            lts[str(i)] = lg.LegoTheme(i, 'Theme %d' % i, None)
+    lts.close()
+
+    lpcs = lg.LegoPartCategoryShelf()
+    with lpcs.batch():
+        for i in range(1, num_part_categories):
+            lpcs[str(i)] = lg.LegoPartCategory(i, 'Category %d' % i)
+    lpcs.close()
+
+    lps = lg.LegoPartShelf()
+    with lps.batch(lconf.shelf_flush_every):
+        for i in range(num_parts):
+            num = str(3000 + i)
+            lps[num] = lg.LegoPart(num, 'Brick %d' % i,
+                                   rnd.randint(1, num_part_categories - 1),
+                                   'https://rebrickable.com/parts/%s/' % num,
+                                   'https://cdn.rebrickable.com/media/parts/'
+                                   'ldraw/%s.png' % num)
+    lps.close()
+
+    les = lg.LegoElementShelf()
+    lss = lg.LegoSetShelf()
+    with les.batch(lconf.shelf_flush_every):
+        fill_set_shelf(lss, num_sets, num_parts, num_colours, les, seed)
+    lss.close()
+    les.close()
+
+    with open(lconf.part_box_csv_file, 'w') as f:
+        for i in range(num_parts):
+            box_num = '%02d' % rnd.randint(1, num_boxes)
+            if rnd.random() < 0.05:
+                box_num = rnd.choice(('00', 'XX'))
+            f.write('%d,%s\n' % (3000 + i, box_num))
+
+    lbs = lg.LegoBoxShelf()
+    lps = lg.LegoPartShelf()
+    lg.fetch_boxes(lps, lbs)
+    lbs.close()
+    lps.close()
+
+
+if __name__ == '__main__':
+
+    lg.debug = 0
+    target = os.path.abspath(sys.argv[1])
+    args = [int(a) for a in sys.argv[2:]]
+    args += [1000, 3000, 60][len(args):]
+    if not os.path.isdir(target):
+        os.makedirs(target)
+    os.chdir(target)
+    start = time.perf_counter()
+    generate(*args)
+    print ('%d sets, %d parts, %d colours in %s: %.1f s' %
+           (tuple(args) + (target, time.perf_counter() - start)))
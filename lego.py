@@ -6,10 +6,17 @@ debug = 1
 
 import shelve
 import csv
-import pandas as pd
+import contextlib
+import operator
+import pickle
+import pickletools
+import itertools
+import array
 import os
 
 import lego_conf as lconf
+import lego_metrics as lmetrics
+import lego_sqlite
 
 
 
@@ -22,21 +29,79 @@ class LegoShelf(shelve.Shelf):
     #
     '''
     
+    # SQLite schema of the shelf records, used when lconf.shelf_backend is 
+    # 'sqlite' (see lego_sqlite.SqliteShelf)
+    
+    record_class = dict
+    columns = ()
+    indexes = ()
+    mapping_fields = {}
+    
     def __init__(self, file_name):
         if not os.path.isdir(lconf.shelves_dir):
             os.mkdir(lconf.shelves_dir)    
 
-        self.shelf = shelve.open(file_name, flag='c', writeback=True)
+        if lconf.shelf_backend == 'sqlite':
+            self.shelf = lego_sqlite.SqliteShelf(
+                    lconf.sqlite_file, os.path.basename(file_name),
+                    self.record_class, self.columns, self.indexes,
+                    self.mapping_fields)
+        else:
+            self.shelf = shelve.open(file_name, flag='c', writeback=True)
+            if self.needs_migration():
+                self.migrate(file_name)
+        self.name = os.path.basename(file_name)
+        self.batch_depth = 0        # nesting level of batch() blocks
+        self.flush_every = None
+        self.pending = 0            # assignments not synced yet
         
     def __len__(self):
         return len(self.shelf)
     
     def __getitem__(self, key):
+        lmetrics.count('shelf.%s.get' % self.name)
         return self.shelf[key]
 
     def __setitem__(self, key, value):
+        lmetrics.count('shelf.%s.set' % self.name)
         self.shelf[key]=value
-        self.shelf.sync()
+        self.changed()
+
+    def changed(self):
+        '''
+        # syncs the shelf after an assignment, unless inside a batch() block
+        '''
+        if self.batch_depth == 0:
+            self.sync()
+            return
+        self.pending += 1
+        if self.flush_every and self.pending >= self.flush_every:
+            self.sync()
+
+    @contextlib.contextmanager
+    def batch(self, flush_every=None):
+        '''
+        # context manager deferring the sync of the shelf to the end of the
+        # block
+        #
+        #   with shelf.batch(flush_every=1000):
+        #       shelf[key] = value
+        #
+        # with flush_every the shelf is also synced every flush_every 
+        # assignments, which bounds the size of the writeback cache
+        #
+        # blocks may be nested, the outermost one commits
+        '''
+        self.batch_depth += 1
+        if self.batch_depth == 1:
+            self.flush_every = flush_every
+        try:
+            yield self
+        finally:
+            self.batch_depth -= 1
+            if self.batch_depth == 0:
+                self.sync()
+                self.flush_every = None
 
     def __delitem__(self, key):
         del(self.shelf[key])
@@ -51,19 +116,226 @@ class LegoShelf(shelve.Shelf):
         self.shelf.close()
         
     def sync(self):
-        self.shelf.sync()
+        with lmetrics.phase('sync'):
+            self.shelf.sync()
+        lmetrics.count('shelf.%s.sync' % self.name)
+        self.pending = 0
         
+    # pandas dtypes of the dataframe columns, by SQLite type; the TEXT 
+    # columns are categorical except key_columns, used to merge shelves
+    
+    key_columns = ()
+    column_dtypes = {'INTEGER': 'Int64', 'BOOLEAN': 'boolean', 
+                     'TEXT': 'category', 'JSON': 'object'}
+    
+    @classmethod
+    def dtypes(cls):
+        return {field : 'str' if field in cls.key_columns 
+                        else cls.column_dtypes[sql_type]
+                for field, sql_type in cls.columns}
+
     def get_dataframe(self):
-        return (pd.DataFrame.from_dict(self.shelf, dtype='str', \
-                                       orient='index'))
+        import pandas as pd
+        keys = list(self.keys())    # each record is read once
+        lmetrics.count('shelf.%s.get' % self.name, len(keys))
+        fields = self.record_class.fields
+        row = operator.attrgetter(*self.record_class.attrs)
+        df = pd.DataFrame.from_records([row(self.shelf[k]) for k in keys],
+                                       index=keys, columns=fields)
+        return (df.astype({c : t for c, t in self.dtypes().items()
+                           if c in df.columns}))
+
+    def needs_migration(self):
+        '''
+        # True if the records of the shelf were pickled as dictionaries, as
+        # they were before LegoRecord; the first record tells
+        '''
+        for key in self.shelf.dict.keys():
+            return any(op.name in ('SETITEM', 'SETITEMS') for op, arg, pos
+                       in pickletools.genops(self.shelf.dict[key]))
+        return False
+
+    def migrate(self, file_name):
+        '''
+        # rewrites the shelf file_name with the compact pickles of its
+        # records (see LegoRecord), into a new file that then replaces it
+        '''
+        if debug:
+            print ('Migrating shelf', file_name)
+        tmp_name = file_name + '.migrating'
+        new = shelve.open(tmp_name, flag='n')
+        for key in self.shelf.dict.keys():
+            new[key.decode('utf-8')] = pickle.loads(self.shelf.dict[key])
+        new.close()
+        self.shelf.close()
+
+        # the dbm modules name their files after file_name differently
+
+        directory, base = os.path.split(tmp_name)
+        for f in os.listdir(directory or '.'):
+            if f.startswith(base):
+                os.replace(os.path.join(directory, f),
+                           file_name + f[len(base):])
+        self.shelf = shelve.open(file_name, flag='c', writeback=True)
             
         
  
+###############################################################################
+#
+# the records of the shelves are LegoRecord objects: their fields live in
+# slots instead of a dictionary, and they are pickled as a tuple
+#
+#   (<version>, <value of the first stored field>, ...)
+#
+# so the field names are not stored again in every record; the fields
+# derived from others, like the local image paths, are not stored at all
+#
+# they still behave as the dictionaries they used to be: record['name'],
+# record.keys(), dict(record)... and the records pickled as dictionaries
+# load as LegoRecord objects (pickle sets their items), so the old shelves
+# are still readable, and LegoShelf rewrites them in the new format when
+# it opens them
+#
+###############################################################################
+
+class LegoRecord:
+    """
+    # base class of the records
+    #
+    # __slots__ : attributes stored, pickled in this order
+    # fields    : the keys of the record, in order, including the derived
+    #             ones (properties)
+    # renamed   : {<field> : <attribute>} for the fields whose attribute
+    #             has another name
+    # version   : version of the pickled tuple; upgrade() converts the
+    #             tuples of older versions
+    """
+
+    __slots__ = ()
+    fields = ()
+    renamed = {}
+    version = 1
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.attrs = tuple(cls.renamed.get(f, f) for f in cls.fields)
+        cls.attr_of = dict(zip(cls.fields, cls.attrs))
+        cls.stored = frozenset(cls.__slots__)
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, self.attr_of[key])
+        except (KeyError, AttributeError):
+            raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key not in self.attr_of:
+            raise KeyError(key)
+        attr = self.attr_of[key]
+        if attr in self.stored:     # the derived fields are recomputed
+            setattr(self, attr, value)
+
+    def __contains__(self, key):
+        return key in self.attr_of
+
+    def __iter__(self):
+        return iter(self.fields)
+
+    def __len__(self):
+        return len(self.fields)
+
+    def keys(self):
+        return self.fields
+
+    def values(self):
+        return [getattr(self, a) for a in self.attrs]
+
+    def items(self):
+        return list(zip(self.fields, self.values()))
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __eq__(self, other):
+        if type(self) is not type(other):
+            return NotImplemented
+        return self.__getstate__() == other.__getstate__()
+
+    __hash__ = None
+
+    def __repr__(self):
+        return '%s(%r)' % (type(self).__name__, dict(self.items()))
+
+    def __getstate__(self):
+        return (self.version,) + tuple(getattr(self, a)
+                                       for a in self.__slots__)
+
+    def __setstate__(self, state):
+        if state[0] != self.version:
+            state = self.upgrade(state)
+        for attr, value in zip(self.__slots__, state[1:]):
+            setattr(self, attr, value)
+
+    def upgrade(self, state):
+        raise ValueError('%s: unknown record version %r' %
+                         (type(self).__name__, state[0]))
+
+
+def local_img_url(img_dir, img_url):
+    '''
+    # local path of the image at img_url, or of the no image picture
+    '''
+    if img_url is None:
+        return img_dir + 'ni.png'
+    return img_dir + img_url.split('/')[-1]
+
+
+def pack_ints(values):
+    '''
+    # packs a sequence of ints in the smallest array type holding all of
+    # them, as bytes: the array typecode followed by its contents
+    '''
+    lo = min(values, default=0)
+    hi = max(values, default=0)
+    for code in 'bhiq':
+        bits = 8 * array.array(code).itemsize
+        if -2 ** (bits - 1) <= lo and hi < 2 ** (bits - 1):
+            break
+    return code.encode('ascii') + array.array(code, values).tobytes()
+
+
+def unpack_ints(data):
+    a = array.array(chr(data[0]))
+    a.frombytes(data[1:])
+    return a
+
+
+def pack_elements(elements):
+    '''
+    # packs a dictionary <element_id : qty> as a tuple of two pack_ints,
+    # the differences between consecutive ids, which are mostly small as
+    # the ids of the elements of a set are mostly consecutive, and the
+    # quantities
+    '''
+    ids = list(elements.keys())
+    deltas = [b - a for a, b in zip([0] + ids, ids)]
+    return (pack_ints(deltas), pack_ints(list(elements.values())))
+
+
+def unpack_elements(packed):
+    deltas, qtys = packed
+    return dict(zip(itertools.accumulate(unpack_ints(deltas)),
+                    unpack_ints(qtys)))
+
+
 ###############################################################################    
     
-class LegoColour(dict):
+class LegoColour(LegoRecord):
     """
-    # 
+    #
     # { 'id'            : <int>,
     #   'name'          : <string>,
     #   'rgb'           : <string>,
@@ -72,29 +344,38 @@ class LegoColour(dict):
     #
     """
 
+    __slots__ = ('id', 'name', 'rgb', 'trans')
+    fields = ('id', 'name', 'rgb', 'is_trans')
+    renamed = {'is_trans': 'trans'}    # is_trans() is the getter
+
     def __init__(self, lc_id, lc_name, lc_rgb, lc_is_trans):
 
-        self['id'] = lc_id
-        self['name'] = lc_name
-        self['rgb'] = lc_rgb
-        self['is_trans'] = lc_is_trans
-        
+        self.id = lc_id
+        self.name = lc_name
+        self.rgb = lc_rgb
+        self.trans = lc_is_trans
+
     def get_id(self):
-        return self['id']
-        
+        return self.id
+
     def get_name(self):
-        return self['name']
-        
+        return self.name
+
     def get_rgb(self):
-        return self['rgb']
-        
+        return self.rgb
+
     def is_trans(self):
-        return self['is_trans']
+        return self.trans
+
 
 class LegoColourShelf(LegoShelf):
     
     file_name = lconf.shelves_dir + 'colours'
     
+    record_class = LegoColour
+    columns = (('id', 'INTEGER'), ('name', 'TEXT'), ('rgb', 'TEXT'),
+               ('is_trans', 'BOOLEAN'))
+    
     def __init__(self):
         LegoShelf.__init__(self, self.file_name)
         
@@ -105,35 +386,42 @@ class LegoColourShelf(LegoShelf):
      
 ###############################################################################    
 
-class LegoTheme(dict):
+class LegoTheme(LegoRecord):
     """
-    # 
+    #
     # { 'id'            : <int>,
     #   'name'          : <string>,
     #   'parent_id'     : <int>
     # }
-    #    
+    #
     """
-    
+
+    __slots__ = ('id', 'name', 'parent_id')
+    fields = __slots__
+
     def __init__(self, lt_id, lt_name, lt_parent_id):
 
-        self['id'] = lt_id
-        self['name'] = lt_name
-        self['parent_id'] = lt_parent_id
-        
+        self.id = lt_id
+        self.name = lt_name
+        self.parent_id = lt_parent_id
+
     def get_id(self):
-        return self['id']
-        
+        return self.id
+
     def get_name(self):
-        return self['name']
-    
+        return self.name
+
     def get_parent_id(self):
-        return self['parent_id']
+        return self.parent_id
+
 
 class LegoThemeShelf(LegoShelf):
     
     file_name = lconf.shelves_dir + 'themes'
     
+    record_class = LegoTheme
+    columns = (('id', 'INTEGER'), ('name', 'TEXT'), ('parent_id', 'INTEGER'))
+    
     def __init__(self):
         LegoShelf.__init__(self, self.file_name)
 
@@ -145,30 +433,37 @@ class LegoThemeShelf(LegoShelf):
 
 ###############################################################################    
 
-class LegoPartCategory(dict):
+class LegoPartCategory(LegoRecord):
     """
-    # 
+    #
     # { 'id'            : <int>,
     #   'name'          : <string>
     # }
-    #    
+    #
     """
-    
+
+    __slots__ = ('id', 'name')
+    fields = __slots__
+
     def __init__(self, ct_id, ct_name):
 
-        self['id'] = ct_id
-        self['name'] = ct_name
-        
+        self.id = ct_id
+        self.name = ct_name
+
     def get_id(self):
-        return self['id']
-        
+        return self.id
+
     def get_name(self):
-        return self['name']
+        return self.name
+
 
 class LegoPartCategoryShelf(LegoShelf):
     
     file_name = lconf.shelves_dir + 'part_categories'
     
+    record_class = LegoPartCategory
+    columns = (('id', 'INTEGER'), ('name', 'TEXT'))
+    
     def __init__(self):
         LegoShelf.__init__(self, self.file_name)        
 
@@ -180,92 +475,94 @@ class LegoPartCategoryShelf(LegoShelf):
        
 ###############################################################################    
 
-class LegoPart(dict):
+class LegoPart(LegoRecord):
     '''
     # { 'num'           : <string>,
     #   'name'          : <string>,
     #   'cat_id'        : <int>,
     #   'url'           : <string>,
     #   'img_url'       : <string> or None
-    #   'local_img_url' : <string> or None
-    #   'box'           : <string> or None
+    #   'box_num'       : <string> or None
+    #   'local_img_url' : <string>, derived from img_url
     # }
     '''
 
+    __slots__ = ('num', 'name', 'cat_id', 'url', 'img_url', 'box_num')
+    fields = __slots__ + ('local_img_url',)
+
     def __init__(self, lp_num, lp_name, lp_cat_id, lp_url, lp_img_url):
 
-        self['num'] = lp_num
-        self['name'] = lp_name
-        self['cat_id'] = lp_cat_id
-        self['url'] = lp_url
-        self['img_url'] = lp_img_url
-        self['box_num'] = None
-        if type(lp_img_url) == type(None) : # no image URL
-            self['local_img_url'] = lconf.element_img_dir + 'ni.png'
-        else :
-            self['local_img_url'] = lconf.element_img_dir + \
-                                    lp_img_url.split('/')[-1]
-                           
+        self.num = lp_num
+        self.name = lp_name
+        self.cat_id = lp_cat_id
+        self.url = lp_url
+        self.img_url = lp_img_url
+        self.box_num = None
+
+    @property
+    def local_img_url(self):
+        return local_img_url(lconf.element_img_dir, self.img_url)
+
     def get_num(self):
-        return self['num']
-        
+        return self.num
+
     def get_name(self):
-        return self['name']
+        return self.name
 
     def get_cat_id(self):
-        return self['cat_id']
-        
+        return self.cat_id
+
     def get_url(self):
-        return self['url']
-    
+        return self.url
+
     def get_img_url(self):
-        return self['img_url']
-    
+        return self.img_url
+
     def get_box_num(self):
-        return self['box_num']
-    
+        return self.box_num
+
     def set_box_num(self, bn):
-        self['box_num'] = bn
+        self.box_num = bn
 
     def get_local_img_url(self):
-        return self['local_img_url']
-    
-                  
-        
+        return self.local_img_url
+
+
 class LegoPartShelf(LegoShelf):
     
     file_name = lconf.shelves_dir + 'parts'
     
+    record_class = LegoPart
+    columns = (('num', 'TEXT'), ('name', 'TEXT'), ('cat_id', 'INTEGER'),
+               ('url', 'TEXT'), ('img_url', 'TEXT'), ('box_num', 'TEXT'),
+               ('local_img_url', 'TEXT'))
+    indexes = ('num', 'cat_id', 'box_num')
+    key_columns = ('num',)
+    
     def __init__(self):
         LegoShelf.__init__(self, self.file_name)
 
 
-    def fetch_boxes(self):
+    def fetch_boxes(self, part_boxes=None):
         '''
-        # Gets the box_num per part_id from part_box.csv and 
-        # sets the box_num in the corresponding LegoPart object
-        #
-        # If box_num == 00 or XX in csv file, sets box_num to '??' in LegoPart
-        # 
-        # ignores the part_ids in csv file not in the shelf
+        # sets the box_num of every LegoPart to its box in part_boxes, a
+        # dictionary <part_num : box_num> (by default load_part_boxes()), 
+        # or to '00' if it isn't in any box
         #
-        # After going through the csv file, for all LegoParts with box_num as 
-        # None, sets box_num to '??'
+        # the shelf is gone through once, and only the parts whose box 
+        # changed are written
         '''
         
-        with open(lconf.part_box_csv_file, 'r') as f:
-            reader = csv.reader(f, delimiter=",")
-            for row in reader:
-                part_id = row[0]
-                box_num = row[1]
-                if debug:
-                    print ("Part: ", part_id, " Box: ", box_num)
-                if part_id in self:
-                    self[part_id].set_box_num(box_num)
-        for lp in self.keys():
-            if self[lp].get_box_num() is None:
-                self[lp].set_box_num('00')
-        self.shelf.sync()
+        if part_boxes is None:
+            part_boxes = load_part_boxes()
+        
+        with self.batch():
+            for part_num in self.keys():
+                lp = self.shelf[part_num]
+                box_num = part_boxes.get(part_num, unboxed)
+                if lp.get_box_num() != box_num:
+                    lp.set_box_num(box_num)
+                    self[part_num] = lp
                     
     def get_dataframe(self):
         df = LegoShelf.get_dataframe(self)
@@ -275,83 +572,120 @@ class LegoPartShelf(LegoShelf):
         
 ###############################################################################    
 
-class LegoElement(dict):
+class LegoElement(LegoRecord):
     '''
     # { 'part_num'        : <string>
     #   'colour_id'       : <int>
     #   'id'              : <int>,
     #   'design_id'       : <int>,
     #   'img_url'         : <string>,
-    #   'local_img_url    : <string>,
-    #   'quantity'        : <int>  ---  used to store the number of elements in 
+    #   'local_img_url    : <string>, derived from img_url
+    #   'quantity'        : <int>  ---  used to store the number of elements in
     #                                   a lego set
     # }
     '''
-    def __init__(self, le_id, le_design_id, le_part_num, le_colour_id, 
+
+    __slots__ = ('id', 'design_id', 'part_num', 'colour_id', 'quantity',
+                 'img_url')
+    fields = __slots__ + ('local_img_url',)
+
+    def __init__(self, le_id, le_design_id, le_part_num, le_colour_id,
                  le_img_url, le_qty):
-        
-        self['id'] = le_id
-        self['design_id'] = le_design_id
-        self['part_num'] = le_part_num
-        self['colour_id'] = le_colour_id
-        self['quantity'] = le_qty
-        self['img_url'] = le_img_url     
-        if type(le_img_url) == type(None) : # no image URL
-            self['local_img_url'] = 'img/elements/ni.png'
-        else :
-            self['local_img_url'] = 'img/elements/' + le_img_url.split('/')[-1]
-        
+
+        self.id = le_id
+        self.design_id = le_design_id
+        self.part_num = le_part_num
+        self.colour_id = le_colour_id
+        self.quantity = le_qty
+        self.img_url = le_img_url
+
+    @property
+    def local_img_url(self):
+        return local_img_url(lconf.element_img_dir, self.img_url)
+
     def get_id(self):
-        return self['id'] 
-    
+        return self.id
+
     def get_design_id(self):
-        return self['design_id']
-    
+        return self.design_id
+
     def get_part_num(self):
-        return self['part_num']
-    
+        return self.part_num
+
     def get_colour_id(self):
-        return self['colour_id']
-    
+        return self.colour_id
+
     def get_img_url(self):
-        return self['img_url']
-    
+        return self.img_url
+
     def get_local_img_url(self):
-        return self['local_img_url']
-    
+        return self.local_img_url
+
     def get_quantity(self):
-        return self['quantity']
-    
+        return self.quantity
+
     def set_quantity(self, qty):
-        self['quantity'] = qty
+        self.quantity = qty
 
 
 class LegoElementShelf(LegoShelf):
     
     file_name = lconf.shelves_dir + 'elements'
     
+    record_class = LegoElement
+    columns = (('id', 'INTEGER'), ('design_id', 'INTEGER'), 
+               ('part_num', 'TEXT'), ('colour_id', 'INTEGER'), 
+               ('quantity', 'INTEGER'), ('img_url', 'TEXT'), 
+               ('local_img_url', 'TEXT'))
+    indexes = ('id', 'part_num', 'colour_id')
+    key_columns = ('part_num',)
+    
     def __init__(self):
         LegoShelf.__init__(self, self.file_name)        
 
     def __setitem__(self, key, value):
+        lmetrics.count('shelf.%s.set' % self.name)
         if key not in self.shelf:
             self.shelf[str(key)]=value
         else:
             le = self.shelf[key]
             le.set_quantity(le.get_quantity() + value.get_quantity())
             self.shelf[str(key)] = le
-        self.shelf.sync()
+        self.changed()
+
+    def replace(self, key, value):
+        '''
+        # stores the element value with its own quantity, discarding the
+        # quantity of the element already in the shelf, if any
+        '''
+        LegoShelf.__setitem__(self, str(key), value)
+
+    def adjust_quantity(self, key, delta):
+        '''
+        # adds delta (which may be negative) to the quantity of the element
+        # with the given key, and removes the element when no unit is left
+        '''
+        key = str(key)
+        if key not in self.shelf:
+            return
+        le = self.shelf[key]
+        qty = le.get_quantity() + delta
+        if qty > 0:
+            le.set_quantity(qty)
+            self.shelf[key] = le
+        else:
+            del(self.shelf[key])
+        self.changed()
 
     def get_dataframe(self):
         df = LegoShelf.get_dataframe(self)
         df = df.add_prefix('element_')
-        df['element_quantity'] = df['element_quantity'].astype(int)
         return (df)
 
 
 ###############################################################################    
 
-class LegoSet(dict):
+class LegoSet(LegoRecord):
     """
     # { 'num'           : <string>,
     #   'name'          : <string>,
@@ -360,159 +694,197 @@ class LegoSet(dict):
     #   'num_parts'     : <int>,
     #   'url'           : <string>,
     #   'img_url'       : <string>,
-    #   'local_img_url' : <string>,
     #   'elements'      : {<element_id>:<qty> ... },
-    #   'quantity'      : <int>  --- use to store how many of this set 
+    #   'local_img_url' : <string>, derived from img_url
+    #   'quantity'      : <int>  --- use to store how many of this set
     #                                the collection holds
     # }
+    #
+    # the elements are pickled packed (see pack_elements)
     """
-    
+
+    __slots__ = ('num', 'name', 'year', 'theme_id', 'num_parts', 'url',
+                 'img_url', 'elements', 'quantity')
+    fields = __slots__[:8] + ('local_img_url', 'quantity')
+
     def __init__(self, ls_num, ls_name, ls_year, ls_theme_id, ls_num_parts,
                  ls_url, ls_img_url, ls_elements, ls_qty):
 
-        self['num'] = ls_num
-        self['name'] = ls_name
-        self['year'] = ls_year
-        self['theme_id'] = ls_theme_id
-        self['num_parts'] = ls_num_parts
-        self['url'] = ls_url
-        self['img_url'] = ls_img_url
-        self['elements'] = ls_elements
-        if type(ls_img_url) == type(None) : # no image URL
-            self['local_img_url'] = lconf.set_img_dir + 'ni.png'
-        else :
-            self['local_img_url'] = lconf.set_img_dir + \
-                                    ls_img_url.split('/')[-1]
-        self['quantity'] = ls_qty
-        
+        self.num = ls_num
+        self.name = ls_name
+        self.year = ls_year
+        self.theme_id = ls_theme_id
+        self.num_parts = ls_num_parts
+        self.url = ls_url
+        self.img_url = ls_img_url
+        self.elements = ls_elements
+        self.quantity = ls_qty
+
+    @property
+    def local_img_url(self):
+        return local_img_url(lconf.set_img_dir, self.img_url)
+
+    def __getstate__(self):
+        state = LegoRecord.__getstate__(self)
+        return state[:8] + (pack_elements(self.elements),) + state[9:]
+
+    def __setstate__(self, state):
+        LegoRecord.__setstate__(self, state)
+        self.elements = unpack_elements(self.elements)
 
     def get_num(self):
-        return self['num']
+        return self.num
 
     def get_name(self):
-        return self['name']
-    
+        return self.name
+
     def get_year(self):
-        return self['year']
+        return self.year
 
     def get_theme_id(self):
-        return self['theme_id']
+        return self.theme_id
 
     def get_num_parts(self):
-        return self['num_parts']
-    
+        return self.num_parts
+
     def get_url(self):
-        return self['url']
+        return self.url
 
     def get_img_url(self):
-        return self['img_url']
+        return self.img_url
 
     def get_local_img_url(self):
-        return self['local_img_url']
+        return self.local_img_url
 
     def get_elements(self):
-        return self['elements']    
-    
+        return self.elements
+
     def get_quantity(self):
-        return self['quantity']
- 
+        return self.quantity
+
     def set_quantity(self, qty):
-        self['quantity'] = qty
+        self.quantity = qty
 
 
 class LegoSetShelf(LegoShelf):
     
     file_name = lconf.shelves_dir +  'sets'
     
+    record_class = LegoSet
+    columns = (('num', 'TEXT'), ('name', 'TEXT'), ('year', 'INTEGER'),
+               ('theme_id', 'INTEGER'), ('num_parts', 'INTEGER'),
+               ('url', 'TEXT'), ('img_url', 'TEXT'), 
+               ('local_img_url', 'TEXT'), ('quantity', 'INTEGER'))
+    indexes = ('num', 'theme_id')
+    key_columns = ('num',)
+    mapping_fields = {'elements': ('element_id INTEGER', 'quantity INTEGER')}
+    
     def __init__(self):
         LegoShelf.__init__(self, self.file_name)    
         
         
     def get_dataframe(self):
-        
-        num_list = []
-        name_list = []
-        year_list = []
-        theme_id_list = []
-        num_parts_list = []
-        img_url_list = []
-        local_img_url_list = []
-        url_list = []
-        element_id_list = []
-        element_quantity_list = []
-        set_quantity_list = []
-        
-        for ls in self.keys():
-            n = len(self[ls].get_elements())
-            num_list += [self[ls].get_num()]*n
-            name_list += [self[ls].get_name()]*n
-            year_list += [self[ls].get_year()]*n
-            theme_id_list += [self[ls].get_theme_id()]*n
-            num_parts_list += [self[ls].get_num_parts()]*n
-            img_url_list += [self[ls].get_img_url()]*n
-            local_img_url_list += [self[ls].get_local_img_url()]*n
-            url_list += [self[ls].get_url()]*n
-            set_quantity_list += [self[ls].get_quantity()]*n
-            for el in self[ls].get_elements().keys():
-                element_id_list.append(el)
-                element_quantity_list.append(self[ls].get_elements()[el])
-            
-        data = {'set_num':num_list,
-               'set_name':name_list,
-               'set_year': year_list,
-               'set_theme_id': theme_id_list,
-               'set_num_parts': num_parts_list,
-               'set_img_url': img_url_list,
-               'set_local_img_url': local_img_url_list,
-               'set_url': url_list,
-               'set_quantity': set_quantity_list,
-               'set_element_id': element_id_list,
-               'set_element_quantity': element_quantity_list}     
-       
-        df = pd.DataFrame(data)
-        df = df.astype(str)
-        df[["set_quantity", "set_element_quantity", "set_num_parts"]] = \
-            df[["set_quantity", "set_element_quantity", \
-                "set_num_parts"]].astype(int)
-        return (df)     
+        '''
+        # returns a dataframe with one row per set and element 
+        #
+        # every set is read once from the shelf; the set columns are built 
+        # once per set and repeated for its elements, and the columns get 
+        # the dtypes of dtypes() directly: the names and urls categorical,
+        # the integers Int64; the element ids and quantities are int64, as
+        # read from the sqlite backend
+        '''
+        import numpy as np
+        import pandas as pd
+        
+        sets = [self[ls] for ls in self.keys()]
+        
+        counts = np.fromiter((len(ls.get_elements()) for ls in sets), 
+                             dtype=np.int64, count=len(sets))
+        n = int(counts.sum())
+        element_ids = np.empty(n, dtype=np.int64)
+        element_qtys = np.empty(n, dtype=np.int64)
+        i = 0
+        for ls, c in zip(sets, counts):
+            ed = ls.get_elements()
+            element_ids[i:i+c] = list(ed.keys())
+            element_qtys[i:i+c] = list(ed.values())
+            i += c
+        
+        def repeat(values, dtype='Int64'):
+            return pd.array(values, dtype=dtype).repeat(counts)
+        
+        def repeat_categorical(values):
+            cat = pd.Categorical(values)
+            return pd.Categorical.from_codes(np.repeat(cat.codes, counts),
+                                             cat.categories)
+        
+        data = {'set_num': repeat([ls.get_num() for ls in sets], 'str'),
+                'set_name': repeat_categorical([ls.get_name() 
+                                                for ls in sets]),
+                'set_year': repeat([ls.get_year() for ls in sets]),
+                'set_theme_id': repeat([ls.get_theme_id() for ls in sets]),
+                'set_num_parts': repeat([ls.get_num_parts() for ls in sets]),
+                'set_img_url': repeat_categorical([ls.get_img_url() 
+                                                   for ls in sets]),
+                'set_local_img_url': repeat_categorical(
+                        [ls.get_local_img_url() for ls in sets]),
+                'set_url': repeat_categorical([ls.get_url() for ls in sets]),
+                'set_quantity': repeat([ls.get_quantity() for ls in sets]),
+                'set_element_id': element_ids,
+                'set_element_quantity': element_qtys}
+        
+        return (pd.DataFrame(data))
 
 ###############################################################################    
 
 
-class LegoBox(dict):
+class LegoBox(LegoRecord):
     '''
     # { 'num'           : <string>,
+    #   'element_ids'   : []
     # }
     '''
-    
+
+    __slots__ = ('num', 'element_ids')
+    fields = __slots__
+
     def __init__(self, box_num):
-        self['num']=box_num
-        self['element_ids']=[] # create an empty LegoBox 
-        
+        self.num = box_num
+        self.element_ids = [] # create an empty LegoBox
+
     def get_num(self):
-        return(self['num'])
-             
-        
+        return(self.num)
+
+
 class LegoBoxShelf(LegoShelf):
     
     file_name = lconf.shelves_dir +  'boxes'
     
+    record_class = LegoBox
+    columns = (('num', 'TEXT'), ('element_ids', 'JSON'))
+    key_columns = ('num',)
+    
     def __init__(self):
         LegoShelf.__init__(self, self.file_name)
         
-    def fetch_boxes(self):
+    def fetch_boxes(self, part_boxes=None):
         '''
-        # Gets the box numbers from boxes.csv and creates and for each box
-        # number adds a LegoBox object with that number to the shelf
+        # makes the shelf hold one LegoBox per box number in part_boxes, a 
+        # dictionary <part_num : box_num> (by default load_part_boxes()), 
+        # removing the boxes no longer in it
         '''
         
-        with open(lconf.part_box_csv_file, 'r') as f:
-            reader = csv.reader(f, delimiter=",")
-            for row in reader:
-                box_num = row[1]
+        if part_boxes is None:
+            part_boxes = load_part_boxes()
+        
+        box_nums = set(part_boxes.values())
+        with self.batch():
+            for box_num in list(self.keys()):
+                if box_num not in box_nums:
+                    del(self[box_num])
+            for box_num in sorted(box_nums):
                 if box_num not in self.shelf:
-                    self.shelf[box_num] = LegoBox(box_num)
-        self.shelf.sync()
+                    self[box_num] = LegoBox(box_num)
 
     def get_dataframe(self):
         df = LegoShelf.get_dataframe(self)
@@ -520,6 +892,73 @@ class LegoBoxShelf(LegoShelf):
         return (df)
 
 
+###############################################################################
+#
+# part_box.csv: one row part_num,box_num per part in a storage box, where
+# the box numbers '00' (unboxed) and 'XX' (unknown box) are sentinels, not
+# real boxes
+#
+###############################################################################
+
+unboxed = '00'
+sentinels = (unboxed, 'XX')
+
+
+def load_part_boxes(file_name=lconf.part_box_csv_file):
+    '''
+    # parses file_name once and returns a dictionary <part_num : box_num>
+    #
+    # malformed rows are skipped, the sentinels are normalised ('xx', '0') 
+    # and, when a part is listed more than once, its last row wins, as each
+    # row used to be applied in turn; all of them are reported
+    '''
+    
+    part_boxes = {}
+    duplicates = []
+    malformed = []
+    with open(file_name, 'r', newline='') as f:
+        for n, row in enumerate(csv.reader(f, delimiter=","), start=1):
+            if len(row) < 2 or not row[0].strip() or not row[1].strip():
+                if any(field.strip() for field in row):
+                    malformed.append(n)
+                continue
+            part_num = row[0].strip()
+            box_num = row[1].strip()
+            if box_num.upper() == 'XX':
+                box_num = 'XX'
+            elif box_num.strip('0') == '':
+                box_num = unboxed
+            if part_num in part_boxes and part_boxes[part_num] != box_num:
+                duplicates.append((part_num, part_boxes[part_num], box_num))
+            part_boxes[part_num] = box_num
+    
+    if malformed:
+        print (file_name + ': malformed rows', 
+               ', '.join(str(n) for n in malformed))
+    for part_num, old, new in duplicates:
+        print (file_name + ': part', part_num, 'in boxes', old, 'and', new,
+               '- using', new)
+    return part_boxes
+
+
+def fetch_boxes(lps, lbs, file_name=lconf.part_box_csv_file):
+    '''
+    # loads file_name once and applies it to the part shelf lps and the box
+    # shelf lbs (see their fetch_boxes), both synced together at the end
+    #
+    # returns the dictionary <part_num : box_num>
+    '''
+    
+    part_boxes = load_part_boxes(file_name)
+    if debug:
+        unknown = [p for p in part_boxes.keys() if p not in lps]
+        print ('Parts in %s: %d, not in the collection: %d, unboxed: %d' %
+               (file_name, len(part_boxes), len(unknown),
+                sum(1 for b in part_boxes.values() if b in sentinels)))
+    with lps.batch(), lbs.batch():
+        lbs.fetch_boxes(part_boxes)
+        lps.fetch_boxes(part_boxes)
+    return part_boxes
 
 
 ###############################################################################
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+
+# lego_aggregations.py
+#
+# declares how the merged collection dataframe (see
+# LegoCollection.merge_collection) is grouped for each kind of html page
+
+import lego_metrics as lmetrics
+
+
+###############################################################################
+#
+# each spec groups the rows of its source by keys and aggregates the other
+# columns as agg says: the quantities are summed, and the descriptive fields,
+# which are the same in all the rows of a group, keep their first value
+#
+# source is None for the merged collection, or the name of another spec whose
+# (smaller) grouped result already holds all the columns needed
+#
+###############################################################################
+
+specs = {
+
+    # one row per element in each box, for the box pages
+
+    'box_page': {
+        'source': None,
+        'keys': ['part_box_num', 'part_category_name', 'part_name',
+                 'part_num', 'colour_id', 'element_local_img_url'],
+        'agg': {'colour_name': 'first',
+                'part_local_img_url': 'first',
+                'element_quantity': 'sum'}},
+
+    # one row per part in each box, for the box index
+
+    'box_index': {
+        'source': 'box_page',
+        'keys': ['part_box_num', 'part_name', 'part_local_img_url'],
+        'agg': {'part_category_name': 'first',
+                'element_quantity': 'sum'}},
+
+    # one row per element in each set, for the set pages
+
+    # (theme_name is a key, so the sets of an unknown theme are left out,
+    # as the set index groups the sets by theme)
+
+    'set_page': {
+        'source': None,
+        'keys': ['set_num', 'theme_name', 'part_box_num', 'part_name',
+                 'colour_id', 'element_local_img_url'],
+        'agg': {'set_name': 'first',
+                'set_num_parts': 'first',
+                'set_local_img_url': 'first',
+                'colour_name': 'first',
+                'element_quantity': 'sum'}},
+
+    # one row per set, for the set index
+
+    'set_index': {
+        'source': 'set_page',
+        'keys': ['set_num', 'theme_name'],
+        'agg': {'set_name': 'first',
+                'set_num_parts': 'first',
+                'set_local_img_url': 'first',
+                'element_quantity': 'sum'}},
+}
+
+
+class Aggregations:
+    """
+    # grouped results of a merged collection dataframe, by spec name
+    #
+    #   agg = Aggregations(df)
+    #   agg['box_index']
+    #
+    # each result is computed on first use and then shared by all the page
+    # builders asking for it, or for a spec using it as source
+    #
+    #   agg.partition('box_page', 'part_box_num')
+    #
+    # splits a result by one of its keys in a single pass, for the builders
+    # of one page per box or set
+    """
+
+    def __init__(self, df):
+        self.df = df
+        self.results = {}
+
+    def __getitem__(self, name):
+        if name not in self.results:
+            spec = specs[name]
+            if spec['source'] is None:
+                source = self.df
+            else:
+                source = self[spec['source']]
+            with lmetrics.phase('aggregate.' + name):
+                self.results[name] = source.groupby(spec['keys'], 
+                                                    observed=True)\
+                                           .agg(spec['agg']).reset_index()
+        return self.results[name]
+
+    def partition(self, name, key):
+        '''
+        # returns a dictionary <value of key : list of records> with the rows
+        # of the result of spec name for each value of key
+        '''
+        result = self[name]
+        parts = {}
+        with lmetrics.phase('partition.' + name):
+            for record in result.to_dict(orient='records'):
+                parts.setdefault(record[key], []).append(record)
+        return parts
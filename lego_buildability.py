@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+
+# lego_buildability.py
+#
+# implements the class Buildability, which answers which sets can be built
+# from the elements owned: the set inventories are a sparse matrix of
+# sets x (part_num, colour_id) compared at once against the vector of the
+# quantities owned, so every set of a whole catalogue is checked in one
+# batched call
+#
+#   keys, stock = lbuild.read_elements(les)
+#   b = lbuild.Buildability(lbuild.set_lines(lss, keys), stock)
+#   b.completion()          # one row per set, most complete first
+#   b.missing(['10030-1'])  # the parts missing to build 10030-1
+
+global debug
+
+debug = 1
+
+
+import numpy as np
+import pandas as pd
+import scipy.sparse
+
+import lego_metrics as lmetrics
+
+
+def read_elements(les, lps=None, box_nums=None):
+    '''
+    # reads the LegoElementShelf les once and returns a tuple (keys, stock):
+    # keys maps each element id to its (part_num, colour_id), and stock
+    # <(part_num, colour_id) : quantity owned>
+    #
+    # with box_nums the stock only counts the parts stored in those boxes,
+    # as the LegoPartShelf lps says
+    '''
+    keys = {}
+    stock = {}
+    if box_nums is not None:
+        box_nums = set(box_nums)
+        in_boxes = {p for p in lps.keys()
+                    if lps[p].get_box_num() in box_nums}
+    for el in les.keys():
+        le = les[el]
+        key = (le.get_part_num(), le.get_colour_id())
+        keys[int(el)] = key
+        if box_nums is None or key[0] in in_boxes:
+            stock[key] = stock.get(key, 0) + le.get_quantity()
+    return keys, stock
+
+
+def set_lines(lss, keys, set_nums=None):
+    '''
+    # generator yielding (set_num, part_num, colour_id, quantity) for the
+    # inventory lines of the sets in the LegoSetShelf lss (or only those in
+    # set_nums), the quantities for a single copy of each set
+    #
+    # keys maps element ids to (part_num, colour_id), see read_elements
+    '''
+    for ls_num in (lss.keys() if set_nums is None else set_nums):
+        for el_id, qty in lss[ls_num].get_elements().items():
+            part_num, colour_id = keys[int(el_id)]
+            yield (ls_num, part_num, colour_id, qty)
+
+
+class Buildability:
+    """
+    # the inventories of a list of sets against a stock of elements
+    #
+    # lines     : iterable of (set_num, part_num, colour_id, quantity), the
+    #             quantities of the same part and colour in a set are added
+    # stock     : dictionary <(part_num, colour_id) : quantity owned>
+    #
+    # self.required is the CSR matrix of the quantities, one row per set of
+    # self.set_nums and one column per (part_num, colour_id) of self.keys,
+    # and self.stock the vector of the quantities owned of self.keys
+    #
+    # each set is checked against the whole stock on its own: the sets
+    # don't compete for the same elements
+    """
+
+    def __init__(self, lines, stock):
+        set_index = {}      # set_num : row
+        key_index = {}      # (part_num, colour_id) : column
+        rows = []
+        cols = []
+        qtys = []
+        for set_num, part_num, colour_id, qty in lines:
+            rows.append(set_index.setdefault(set_num, len(set_index)))
+            cols.append(key_index.setdefault((part_num, colour_id),
+                                             len(key_index)))
+            qtys.append(qty)
+        self.set_nums = list(set_index.keys())
+        self.keys = list(key_index.keys())
+        self.row_of = set_index
+        self.required = scipy.sparse.coo_matrix(
+                (np.array(qtys, dtype=np.int64),
+                 (np.array(rows, dtype=np.int64),
+                  np.array(cols, dtype=np.int64))),
+                shape=(len(self.set_nums), len(self.keys))).tocsr()
+        self.required.sum_duplicates()
+        self.stock = np.array([stock.get(k, 0) for k in self.keys],
+                              dtype=np.int64)
+        lmetrics.count('buildability.sets', len(self.set_nums))
+        lmetrics.count('buildability.lines', len(qtys))
+
+    def _rows(self, set_nums):
+        '''
+        # returns the row numbers of set_nums (all the sets if None),
+        # skipping the sets without inventory
+        '''
+        if set_nums is None:
+            return np.arange(len(self.set_nums))
+        unknown = [s for s in set_nums if s not in self.row_of]
+        if unknown and debug:
+            print ('Sets without inventory:', ', '.join(unknown))
+        return np.array([self.row_of[s] for s in set_nums
+                         if s in self.row_of], dtype=np.int64)
+
+    def _owned(self, required):
+        '''
+        # returns the quantities of each nonzero of required that the stock
+        # covers
+        '''
+        return np.minimum(required.data, self.stock[required.indices])
+
+    def completion(self, set_nums=None):
+        '''
+        # returns a dataframe with one row per set of set_nums (by default
+        # all of them), most complete first:
+        #
+        # set_num, parts (needed to build it), owned (of those parts),
+        # missing (parts - owned), lines_missing (distinct parts and colours
+        # missing) and completion (owned / parts, 1.0 if it can be built)
+        '''
+        rows = self._rows(set_nums)
+        required = self.required[rows]
+        owned = required.copy()
+        owned.data = self._owned(required)
+        short = required.copy()
+        short.data = required.data - owned.data
+        short.eliminate_zeros()
+
+        parts = np.asarray(required.sum(axis=1)).ravel()
+        have = np.asarray(owned.sum(axis=1)).ravel()
+        df = pd.DataFrame({
+                'set_num': [self.set_nums[r] for r in rows],
+                'parts': parts,
+                'owned': have,
+                'missing': parts - have,
+                'lines_missing': np.diff(short.indptr),
+                'completion': np.divide(have, parts,
+                                        out=np.ones(len(rows)),
+                                        where=parts > 0)})
+        return (df.sort_values(['completion', 'parts'],
+                               ascending=[False, False], kind='stable')
+                  .reset_index(drop=True))
+
+    def missing(self, set_nums=None):
+        '''
+        # returns a dataframe with the parts missing to build each set of
+        # set_nums (by default all of them), in a single batch:
+        #
+        # set_num, part_num, colour_id, needed, owned, missing
+        '''
+        rows = self._rows(set_nums)
+        required = self.required[rows]
+        owned = self._owned(required)
+        mask = owned < required.data
+        set_of = np.repeat(rows, np.diff(required.indptr))[mask]
+        cols = required.indices[mask]
+        return pd.DataFrame({
+                'set_num': [self.set_nums[r] for r in set_of],
+                'part_num': [self.keys[c][0] for c in cols],
+                'colour_id': [self.keys[c][1] for c in cols],
+                'needed': required.data[mask],
+                'owned': owned[mask],
+                'missing': required.data[mask] - owned[mask]})
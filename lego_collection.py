@@ -8,83 +8,300 @@ Created on Mon Dec  3 09:07:49 2018
 global debug 
 debug = 1
 
+snapshot_version = 3
+
+# phases of a build from Rebrickable.com recorded in its journal, all of them
+# done when the build is complete
+
+build_phases = ('colours', 'themes', 'part_categories', 'main_shelves')
+
 import os
-import pandas as pd
+import sys
+import hashlib
+import argparse
 
 import lego as lg
-import rebrickable as rb
+import lego_aggregations as lagg
+import lego_metrics as lmetrics
+import lego_render as lrender
+import rebrickable_journal as rbjournal
 import lego_conf as lconf
 
-from jinja2 import Environment, FileSystemLoader, select_autoescape
-env = Environment(
-    loader=FileSystemLoader(lconf.jinja2_template_dir), # path to template files
-    autoescape=select_autoescape(['html', 'xml'])
-) 
+
+class LazyShelf:
+    '''
+    # attribute of LegoCollection holding a shelf of shelf_class, opened on
+    # its first access and kept open in LegoCollection.shelves until 
+    # close_shelves(), so each menu option only opens the shelves it uses
+    '''
+
+    def __init__(self, shelf_class):
+        self.shelf_class = shelf_class
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, lc, owner=None):
+        if lc is None:
+            return self
+        shelf = lc.shelves.get(self.name)
+        if shelf is None:
+            shelf = lc.shelves[self.name] = self.shelf_class()
+        return shelf
+
+    def __set__(self, lc, shelf):
+        lc.shelves[self.name] = shelf
 
 
 class LegoCollection: 
 
+    lcs = LazyShelf(lg.LegoColourShelf)
+    lts = LazyShelf(lg.LegoThemeShelf)
+    lpcs = LazyShelf(lg.LegoPartCategoryShelf)
+    lps = LazyShelf(lg.LegoPartShelf)
+    les = LazyShelf(lg.LegoElementShelf)
+    lss = LazyShelf(lg.LegoSetShelf)
+    lbs = LazyShelf(lg.LegoBoxShelf)
+
     def __init__(self):
 
-        self.reb = rb.Rebrickable()
+        self._reb = None
+        self.open_shelves()
+
+    @property
+    def reb(self):
+        '''
+        # the Rebrickable client, created (and requests imported) only when 
+        # an option needs the API
+        '''
+        if self._reb is None:
+            import rebrickable as rb
+            self._reb = rb.Rebrickable()
+        return self._reb
+
+    def open_shelves(self):
+        '''
+        # the shelves are opened on their first access (see LazyShelf)
+        '''
+        self.shelves = {}   # attribute name : open shelf
+
+    def close_shelves(self):
+        
+        for shelf in self.shelves.values():
+            shelf.close()
+        self.shelves = {}
 
-        self.lcs = lg.LegoColourShelf()
-        self.lts = lg.LegoThemeShelf()       
-        self.lpcs = lg.LegoPartCategoryShelf()        
-        self.lps = lg.LegoPartShelf()        
-        self.les = lg.LegoElementShelf()        
-        self.lss = lg.LegoSetShelf()        
-        self.lbs = lg.LegoBoxShelf()
+    def close_shelf(self, attr):
+        '''
+        # closes the shelf attr if it is open; it is reopened on its next 
+        # access
+        '''
+        shelf = self.shelves.pop(attr, None)
+        if shelf is not None:
+            shelf.close()
 
-    def build_collection(self):
+    @lmetrics.timed('build_collection')
+    def build_collection(self, csv_dir=None, resume=False):
+        '''
+        # builds the local database from scratch
+        #
+        # if csv_dir is given, the catalogue and the set inventories are 
+        # loaded from the Rebrickable CSV downloads in that directory and the
+        # API is only used for the user set list; such shelves can't be
+        # synced (see sync_collection)
+        #
+        # a build from Rebrickable.com is checkpointed in the journal
+        # lconf.fetch_journal_file (see rebrickable_journal.py), removed when
+        # the build completes; with resume an interrupted build keeps its 
+        # shelves and goes on from the journal instead of starting again
+        #
+        # returns a tuple (the list of set numbers that could not be 
+        # fetched, the list of the build_phases not completed); the build 
+        # is complete when both are empty
+        '''
         
+        # the fetchers open their own shelves, so close ours while they run
+        
+        self.close_shelves()
+        
+        resume = resume and csv_dir is None and \
+                 os.path.isfile(lconf.fetch_journal_file)
+
         # create the shelves directory if it doesn't exist
-        # empty the shelves directory if not empty
+        # empty the shelves directory if not empty, keeping the cache of 
+        # Rebrickable responses in its subdirectory, unless resuming
         
-        reb = rb.Rebrickable()
-                
-        if os.path.isdir(lconf.shelves_dir):
-            list(map(os.unlink, (os.path.join(lconf.shelves_dir,f) \
-                                 for f in os.listdir(lconf.shelves_dir))))
-        else:
+        if not os.path.isdir(lconf.shelves_dir):
             os.mkdir(lconf.shelves_dir)    
+        elif not resume:
+            list(map(os.unlink, (os.path.join(lconf.shelves_dir,f) \
+                                 for f in os.listdir(lconf.shelves_dir) \
+                                 if os.path.isfile(os.path.join( \
+                                         lconf.shelves_dir, f)))))
 
-        # fetch data from rebrickable
+        # fetch data from rebrickable, skipping the phases in the journal,
+        # or from its CSV downloads
         
-        reb.fetch_colour_shelf()
-        reb.fetch_theme_shelf()
-        reb.fetch_part_category_shelf()
-        reb.fetch_main_shelves()
+        failed = []
+        unfinished = []
+        with lmetrics.phase('fetch'):
+            if csv_dir is None:
+                journal = rbjournal.FetchJournal(lconf.fetch_journal_file, 
+                                                 resume)
+                for phase, fetch in (
+                        ('colours', self.reb.fetch_colour_shelf),
+                        ('themes', self.reb.fetch_theme_shelf),
+                        ('part_categories', 
+                         self.reb.fetch_part_category_shelf)):
+                    if phase not in journal.phases and fetch():
+                        journal.phase_done(phase)
+                failed = self.reb.fetch_main_shelves(journal=journal)
+            else:
+                import rebrickable_csv as rbcsv
+                source = rbcsv.RebrickableCSV(csv_dir)
+                source.fetch_colour_shelf()
+                source.fetch_theme_shelf()
+                source.fetch_part_category_shelf()
+                source.fetch_main_shelves()
+                with open(lconf.csv_build_file, 'w') as f:
+                    f.write(csv_dir)
         
-        # fetch element images
+        self.open_shelves()
         
-        for el in self.les.keys():
-            if debug:
-                print ('Fetching img for element ', el)
-            self.reb.fetch_img(self.les[el].get_img_url(), 
-                         self.les[el].get_local_img_url())
-
-        # fetch set images
-            
-        for s in self.lss.keys():
-            if debug:
-                print ('Fetching img for set ', s)
-            self.reb.fetch_img(self.lss[s].get_img_url(), 
-                         self.lss[s].get_local_img_url())
+        # fetch element and set images, each distinct image only once
+        
+        with lmetrics.phase('images'):
+            imgs = {}
+            for el in self.les.keys():
+                le = self.les[el]
+                imgs[le.get_img_url()] = le.get_local_img_url()
+            for s in self.lss.keys():
+                ls = self.lss[s]
+                imgs[ls.get_img_url()] = ls.get_local_img_url()
+            self.reb.fetch_imgs(imgs)
 
         # fetch local data
 
-        lg.LegoBoxShelf().fetch_boxes()
-        lg.LegoPartShelf().fetch_boxes()
+        with lmetrics.phase('boxes'):
+            lg.fetch_boxes(self.lps, self.lbs)
         
-
+        if csv_dir is None:
+            unfinished = [p for p in build_phases if p not in journal.phases]
+            if unfinished:
+                journal.close()
+                print ('The build is incomplete (%s), resume it with '
+                       '--resume' % ', '.join(unfinished))
+            else:
+                journal.remove()
+        return failed, unfinished
+        
+    @lmetrics.timed('sync_collection')
+    def sync_collection(self):
+        '''
+        # incremental alternative to build_collection
+        #
+        # compares the user set list in Rebrickable <set_num:qty> with the
+        # sets in the LegoSetShelf and
+        #   - fetches the inventories of the new sets only
+        #   - removes the sets no longer in the list, subtracting their 
+        #     elements from the LegoElementShelf
+        #   - updates the quantity of the sets whose quantity changed, 
+        #     adjusting the quantity of their elements
+        #
+        # the colour, theme and part category shelves are only fetched if 
+        # they are empty
+        #
+        # returns the list of new set numbers that could not be fetched; as
+        # they are not in the LegoSetShelf, the next sync fetches them again
+        #
+        # returns None, without syncing, if the shelves were built from the
+        # CSV downloads: their element ids are row numbers of the CSV files,
+        # not the ids of the API, so the elements fetched would be added 
+        # under other keys than those of the same elements in the shelf
+        '''
+        
+        if os.path.isfile(lconf.csv_build_file):
+            with open(lconf.csv_build_file, 'r') as f:
+                csv_dir = f.read()
+            print ('The shelves were built from the CSV downloads in %s and '
+                   'can\'t be synced, build them again to update them' 
+                   % csv_dir)
+            return None
+        
+        for attr, fetch in (
+                ('lcs', self.reb.fetch_colour_shelf),
+                ('lts', self.reb.fetch_theme_shelf),
+                ('lpcs', self.reb.fetch_part_category_shelf)):
+            if len(getattr(self, attr)) == 0:
+                self.close_shelf(attr)  # the fetch opens its own shelf
+                fetch()
+        
+        remote = self.reb.fetch_set_list()
+        local = {ls_num : self.lss[ls_num].get_quantity() 
+                 for ls_num in self.lss.keys()}
+        
+        # removed sets and sets whose quantity changed
+        
+        with self.les.batch(), self.lss.batch():
+            for ls_num, old_qty in local.items():
+                new_qty = remote.get(ls_num, 0)
+                if new_qty == old_qty:
+                    continue
+                if debug:
+                    print ('Set', ls_num, 'quantity', old_qty, '->', new_qty)
+                ls = self.lss[ls_num]
+                for el, qty in ls.get_elements().items():
+                    self.les.adjust_quantity(el, qty * (new_qty - old_qty))
+                if new_qty:
+                    ls.set_quantity(new_qty)
+                    self.lss[ls_num] = ls
+                else:
+                    del(self.lss[ls_num])
+        
+        # new sets
+        
+        sd = {ls_num : qty for ls_num, qty in remote.items() 
+              if ls_num not in local}
+        if debug:
+            print ('New sets:', len(sd))
+        with lmetrics.phase('fetch'):
+            failed = self.reb.add_sets(sd, self.lps, self.les, self.lss)
+        
+        with lmetrics.phase('images'):
+            imgs = {}
+            for ls_num in sd.keys():
+                if ls_num not in self.lss:
+                    continue
+                ls = self.lss[ls_num]
+                imgs[ls.get_img_url()] = ls.get_local_img_url()
+                for el in ls.get_elements().keys():
+                    le = self.les[str(el)]
+                    imgs[le.get_img_url()] = le.get_local_img_url()
+            self.reb.fetch_imgs(imgs)
+        
+        # the new parts need their box numbers
+        
+        with lmetrics.phase('boxes'):
+            lg.fetch_boxes(self.lps, self.lbs)
+        
+        return failed
        
         
-    def merge_collection(self):
+    @lmetrics.timed('merge_collection')
+    def merge_collection(self, set_nums=None, box_nums=None):
         '''
         # merges the collection shelves and returns a pandas dataframe
+        #
+        # set_nums and box_nums optionally restrict the result to the rows of
+        # those sets and boxes
+        #
+        # with the sqlite backend the joins and filters run in SQLite
         '''
+        
+        if lconf.shelf_backend == 'sqlite':
+            return self.merge_collection_sql(set_nums, box_nums)
 
+        import pandas as pd
       
         ledf = self.les.get_dataframe()
         lcdf = self.lcs.get_dataframe()
@@ -124,115 +341,264 @@ class LegoCollection:
         
 #        df.to_csv("dataframe.csv")
 
+        if set_nums is not None:
+            df = df.loc[df['set_num'].isin(set_nums)]
+        if box_nums is not None:
+            df = df.loc[df['part_box_num'].isin(box_nums)]
+
+        lmetrics.count('merge_collection.rows', len(df))
         return (df) # returns a data frame (see structure in doc)
 
+    def merge_collection_sql(self, set_nums=None, box_nums=None):
+        '''
+        # merge_collection as a single SQL query over the sqlite backend
+        # tables; returns the same columns, cast to the dtypes the shelves
+        # declare (LegoShelf.dtypes), which are also those of the shelf 
+        # dataframes merged by merge_collection
+        '''
+        
+        query = '''
+            SELECT s.num AS set_num, s.name AS set_name, 
+                   s.year AS set_year, s.num_parts AS set_num_parts, 
+                   s.img_url AS set_img_url, 
+                   s.local_img_url AS set_local_img_url, 
+                   s.url AS set_url, s.quantity AS set_quantity,
+                   e.id AS element_id, e.design_id AS element_design_id,
+                   e.quantity AS element_quantity, 
+                   e.img_url AS element_img_url,
+                   e.local_img_url AS element_local_img_url,
+                   c.id AS colour_id, c.name AS colour_name, 
+                   c.rgb AS colour_rgb, c.is_trans AS colour_is_trans,
+                   p.num AS part_num, p.name AS part_name, 
+                   p.cat_id AS part_cat_id, p.url AS part_url,
+                   p.img_url AS part_img_url, p.box_num AS part_box_num,
+                   p.local_img_url AS part_local_img_url,
+                   pc.name AS part_category_name,
+                   t.id AS theme_id, t.name AS theme_name, 
+                   t.parent_id AS theme_parent_id
+            FROM sets s 
+            JOIN sets_elements se ON se.key = s.key
+            LEFT JOIN elements e ON e.id = se.element_id
+            LEFT JOIN colours c ON c.id = e.colour_id
+            LEFT JOIN parts p ON p.num = e.part_num
+            LEFT JOIN part_categories pc ON pc.id = p.cat_id
+            LEFT JOIN themes t ON t.id = s.theme_id
+            '''
+        
+        where = []
+        params = []
+        for column, values in (('s.num', set_nums), ('p.box_num', box_nums)):
+            if values is not None:
+                values = list(values)
+                where.append('%s IN (%s)' % (column, 
+                                             ', '.join('?' * len(values))))
+                params += values
+        if where:
+            query += ' WHERE ' + ' AND '.join(where)
+        
+        for shelf in (self.lcs, self.lts, self.lpcs, self.lps, self.les, 
+                      self.lss):
+            shelf.sync()    # the query must see the cached records
+        
+        import pandas as pd
+        df = pd.read_sql_query(query, self.lss.shelf.con, params=params)
+        
+        # the same dtypes as the shelf dataframes
+        
+        dtypes = {}
+        for shelf, prefix in ((self.lcs, 'colour_'), (self.lts, 'theme_'),
+                              (self.lpcs, 'part_category_'), 
+                              (self.lps, 'part_'), (self.les, 'element_'),
+                              (self.lss, 'set_')):
+            dtypes.update({prefix + c : t for c, t in shelf.dtypes().items()
+                           if prefix + c in df.columns})
+        lmetrics.count('merge_collection.rows', len(df))
+        return df.astype(dtypes)
+
+    @lmetrics.timed('fingerprint')
+    def collection_fingerprint(self):
+        '''
+        # returns a hash of the contents of the shelf files and of
+        # part_box.csv, which changes whenever the merged collection would
+        #
+        # snapshot_version is hashed too, to be increased whenever the 
+        # columns or dtypes of merge_collection change
+        '''
+        
+        for shelf in (self.lcs, self.lts, self.lpcs, self.lps, self.les, 
+                      self.lss, self.lbs):
+            shelf.sync()    # the shelf files must be up to date
+        
+        h = hashlib.sha1(b'%d' % snapshot_version)
+        files = sorted(os.path.join(lconf.shelves_dir, f) 
+                       for f in os.listdir(lconf.shelves_dir)
+                       if not f.endswith('-shm'))
+        for file_name in files + [lconf.part_box_csv_file]:
+            if not os.path.isfile(file_name):
+                continue
+            h.update(file_name.encode('utf-8'))
+            with open(file_name, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    h.update(chunk)
+        return h.hexdigest()
+
+    @lmetrics.timed('load_collection')
+    def load_collection(self, fingerprint=None):
+        '''
+        # returns merge_collection(), read memory-mapped from the Feather 
+        # snapshot in lconf.snapshot_dir if it was written from the current 
+        # shelves and part_box.csv; otherwise merges the collection and 
+        # writes a new snapshot
+        #
+        # without pyarrow there are no snapshots and the collection is 
+        # always merged
+        #
+        # fingerprint is collection_fingerprint(), if already computed
+        '''
+        
+        if fingerprint is None:
+            fingerprint = self.collection_fingerprint()
+        file_name = os.path.join(lconf.snapshot_dir, 
+                                 'collection-' + fingerprint + '.feather')
+        try:
+            import pyarrow.feather
+            
+            if os.path.isfile(file_name):
+                if debug:
+                    print ('Loading collection snapshot', file_name)
+                lmetrics.count('load_collection.snapshot_hits')
+                return pyarrow.feather.read_feather(file_name, 
+                                                    memory_map=True)
+            
+            df = self.merge_collection()
+            
+            if not os.path.isdir(lconf.snapshot_dir):
+                os.mkdir(lconf.snapshot_dir)
+            for f in os.listdir(lconf.snapshot_dir):   # older snapshots
+                os.unlink(os.path.join(lconf.snapshot_dir, f))
+            df.reset_index(drop=True).to_feather(file_name + '.tmp')
+            os.replace(file_name + '.tmp', file_name)
+            return df
+        
+        except ImportError:     # pyarrow is not installed
+            return self.merge_collection()
+
+    @lmetrics.timed('buildability')
+    def buildability(self, csv_dir=None, box_nums=None):
+        '''
+        # returns a lego_buildability.Buildability of the sets in the 
+        # LegoSetShelf, or of every set in the Rebrickable CSV downloads in 
+        # csv_dir, against the elements owned, or only those stored in the
+        # boxes box_nums
+        '''
+        
+        import lego_buildability as lbuild
+        
+        keys, stock = lbuild.read_elements(self.les, self.lps, box_nums)
+        if csv_dir is None:
+            lines = lbuild.set_lines(self.lss, keys)
+        else:
+            import rebrickable_csv as rbcsv
+            lines = rbcsv.RebrickableCSV(csv_dir).inventory_lines()
+        return lbuild.Buildability(lines, stock)
+
 ###############################################################################                            
 
-    def build_html(self, param=None):
+    @lmetrics.timed('build_html')
+    def build_html(self, param=None, jobs=1):
+        '''
+        # builds the html pages of the boxes or of the sets, rendering them
+        # with jobs processes (see lego_render.render_pages)
+        #
+        # only the pages whose records or template changed are rendered, and
+        # the pages of boxes or sets no longer in the collection are deleted
+        # (see lego_render.Manifest)
+        '''
         
         if param == None:
             print ("build_html: expects one parameter")
         elif param == "boxes":
             
-            df  = lc.merge_collection() 
+            fingerprint = self.collection_fingerprint()
+            manifest = lrender.Manifest(lconf.box_html_dir)
+            if manifest.up_to_date(fingerprint):
+                if debug:
+                    print ("build_html: the box pages are up to date")
+                return
+            
+            agg = lagg.Aggregations(self.load_collection(fingerprint))
         
-            # create the box index
-
-            template = env.get_template(lconf.boxes_template_file)
-               
-            gdf = df.groupby(['part_name', 'part_category_name', \
-                              'part_local_img_url', \
-                              'part_box_num']).sum().reset_index()
-
-       
-            ed = gdf.to_dict(orient='index')
-
-            el = []
-            for i in ed.keys():
-                el.append(ed[i])
-
-            with open(lconf.box_html_dir + "boxes.html", mode="w", \
-                      encoding='utf-8') as file_a:
-                file_a.write(template.render(elements = el))
+            # the box index
+            
+            tasks = [(lconf.boxes_template_file, 
+                      lconf.box_html_dir + "boxes.html",
+                      {'elements': agg['box_index'].to_dict(
+                              orient='records')})]
 
-            # create the individual box pages
+            # the individual box pages
         
-            template = env.get_template(lconf.box_template_file)
+            boxes = agg.partition('box_page', 'part_box_num')
 
             for box_num in self.lbs.keys():
 
                 if debug:
                     print ("Processing box: ", box_num)
              
-                fdf = df.loc[df['part_box_num'] == box_num]
-                fdf = fdf.groupby(['part_category_name', 'part_name', \
-                               'colour_id', 'colour_name', 'part_num', \
-                               'element_local_img_url']).sum().reset_index()
-        
-                ed = fdf.to_dict(orient='index')
-
-                el = []
-                for i in ed.keys():
-                    el.append(ed[i])
+                el = boxes.get(box_num, [])
             
                 file_name = lconf.box_html_dir + "box-" + box_num +".html"
-
-                with open(file_name, mode="w", encoding='utf-8') \
-                    as file_a:
-                        file_a.write(template.render(box_num = box_num, \
-                                                     elements = el))
+                tasks.append((lconf.box_template_file, file_name,
+                              {'box_num': box_num, 'elements': el}))
+            
+            lmetrics.count('build_html.pages', len(tasks))
+            tasks = manifest.changed(tasks)
+            with lmetrics.phase('render'):
+                lrender.render_pages(tasks, jobs)
+            lmetrics.count('build_html.pages_rendered', len(tasks))
+            manifest.save(fingerprint)
 
         elif param == "sets":
         
-            df  = lc.merge_collection() 
-
-            # create the set index
-
-            template = env.get_template(lconf.sets_template_file)
-               
-            gdf = df.groupby(['set_num', 'set_name', 'set_num_parts', \
-                              'set_local_img_url', \
-                              'theme_name']).sum().reset_index()
-   
-            ed = gdf.to_dict(orient='index')
+            fingerprint = self.collection_fingerprint()
+            manifest = lrender.Manifest(lconf.set_html_dir)
+            if manifest.up_to_date(fingerprint):
+                if debug:
+                    print ("build_html: the set pages are up to date")
+                return
+            
+            agg = lagg.Aggregations(self.load_collection(fingerprint))
 
-            el = []
-            for i in ed.keys():
-                el.append(ed[i])
+            # the set index
 
-            with open(lconf.set_html_dir + "sets.html", mode="w", \
-                      encoding='utf-8') as file_a:
-                file_a.write(template.render(sets = el))
+            tasks = [(lconf.sets_template_file, 
+                      lconf.set_html_dir + "sets.html",
+                      {'sets': agg['set_index'].to_dict(orient='records')})]
 
-            # create the individual set pages
+            # the individual set pages
 
-            template = env.get_template(lconf.set_template_file)
-               
-            gdf = df.groupby(['set_num', 'set_name', 'set_num_parts', \
-                              'set_local_img_url', 'theme_name', \
-                              'part_box_num', 'part_name', \
-                              'colour_name', 'colour_id', \
-                              'element_local_img_url']).sum().reset_index()
+            sets = agg.partition('set_page', 'set_num')
 
             for set_num in self.lss.keys():
             
-                fdf = gdf.loc[gdf['set_num'] == set_num] # filter by set num
+                el = sets.get(set_num)
+                if not el:  # no elements
+                    continue
+
+                tasks.append((lconf.set_template_file, 
+                              lconf.set_html_dir + set_num + ".html",
+                              {'set_num': el[0]['set_num'],
+                               'set_name': el[0]['set_name'],
+                               'set_num_parts': el[0]['set_num_parts'],
+                               'set_local_img_url': el[0]['set_local_img_url'],
+                               'theme_name': el[0]['theme_name'],
+                               'elements': el}))
             
-                ed = fdf.to_dict(orient='index')
-
-                el = []
-                for i in ed.keys():
-                    el.append(ed[i])
-
-                with open(lconf.set_html_dir + set_num + ".html", \
-                          mode="w", encoding='utf-8') as file_a:
-                    file_a.write(template.render( \
-                                set_num = el[0]['set_num'],
-                                set_name = el[0]['set_name'],
-                                set_num_parts = el[0]['set_num_parts'],
-                                set_local_img_url = el[0]['set_local_img_url'],
-                                theme_name = el[0]['theme_name'],
-                                elements = el))
+            lmetrics.count('build_html.pages', len(tasks))
+            tasks = manifest.changed(tasks)
+            with lmetrics.phase('render'):
+                lrender.render_pages(tasks, jobs)
+            lmetrics.count('build_html.pages_rendered', len(tasks))
+            manifest.save(fingerprint)
 
         else: 
             print ("build_html: expects 'boxes or sets'")
@@ -245,13 +611,69 @@ class LegoCollection:
    
 if __name__ == '__main__':
 
+    parser = argparse.ArgumentParser(description='Lego collection')
+    parser.add_argument('--jobs', type=int, default=1, 
+                        help='processes rendering the html pages')
+    parser.add_argument('--metrics', metavar='FILE',
+                        help='JSON file to write the metrics of each run to')
+    parser.add_argument('--profile', metavar='DIR',
+                        help='directory to write a cProfile dump per phase')
+    parser.add_argument('--build', action='store_true',
+                        help='build your local database and exit, without '
+                        'the menu')
+    parser.add_argument('--resume', action='store_true',
+                        help='like --build, resuming an interrupted build')
+    parser.add_argument('--csv', metavar='DIR',
+                        help='with --build, build from the Rebrickable CSV '
+                        'downloads in DIR (such a build can\'t be resumed or '
+                        'synced)')
+    parser.add_argument('--sync', action='store_true',
+                        help='sync your local database and exit')
+    parser.add_argument('--html', action='append', choices=('sets', 'boxes'),
+                        help='build the html pages of your sets or boxes and '
+                        'exit; may be repeated')
+    args = parser.parse_args()
+    if args.csv and not args.build:
+        parser.error('--csv requires --build')
+    if args.csv and args.resume:
+        parser.error('a build from --csv can\'t be resumed')
+    if args.csv and args.sync:
+        parser.error('a build from --csv can\'t be synced')
+    
+    if args.profile:
+        lmetrics.enable_profiling(args.profile)
+
     lc = LegoCollection()
+    
+    # non-interactive run: the options given, in the order build, sync, 
+    # html; the exit status is 1 if the build or the sync is incomplete 
+    # (some set or phase could not be fetched)
+    
+    if args.build or args.resume or args.sync or args.html:
+        failed, unfinished = [], []
+        if args.build or args.resume:
+            failed, unfinished = lc.build_collection(args.csv, args.resume)
+        if args.sync:
+            sync_failed = lc.sync_collection()
+            if sync_failed is None:     # shelves built from CSV downloads
+                unfinished.append('sync')
+            else:
+                failed += sync_failed
+        for param in args.html or ():
+            lc.build_html(param, args.jobs)
+        lmetrics.report(args.metrics)
+        lc.close_shelves()
+        sys.exit(1 if failed or unfinished else 0)
       
     while 1:
         print ("Menú:")
         print ("1 - Fetch your data from Rebrickable and build your local database")
         print ("2 - Build html pages for all the sets you own")
         print ("3 - Build html pages for all your storage boxes")
+        print ("4 - Sync your local database with your Rebrickable set list")
+        print ("5 - Build your local database from Rebrickable CSV downloads")
+        print ("6 - Resume an interrupted build of your local database")
+        print ("7 - Find the sets of the Rebrickable CSV downloads you can build")
         print ("x - Exit")
         option = input("Choose an option: ")
         if (option == "1"):
@@ -259,13 +681,29 @@ if __name__ == '__main__':
             print (lc.build_collection())
         elif (option == "2"):
             print ("You've chosen 2 - build_html('sets')")
-            lc.build_html('sets')
+            lc.build_html('sets', args.jobs)
         elif (option == "3"):
             print ("You've chosen 3 - build_html('boxes')")
-            lc.build_html('boxes')
+            lc.build_html('boxes', args.jobs)
+        elif (option == "4"):
+            print ("You've chosen 4 - sync_collection()")
+            lc.sync_collection()
+        elif (option == "5"):
+            print ("You've chosen 5 - build_collection(lconf.csv_dump_dir)")
+            lc.build_collection(lconf.csv_dump_dir)
+        elif (option == "6"):
+            print ("You've chosen 6 - build_collection(resume=True)")
+            print (lc.build_collection(resume=True))
+        elif (option == "7"):
+            print ("You've chosen 7 - buildability(lconf.csv_dump_dir)")
+            df = lc.buildability(lconf.csv_dump_dir).completion()
+            print (df.head(lconf.buildable_sets_shown).to_string())
         elif  (option == "x"):
             break
         else:
             print ("Try again")
+            continue
+        lmetrics.report(args.metrics)
+        lmetrics.reset()
 
 
@@ -8,19 +8,70 @@ Created on Wed Dec 12 08:41:30 2018
 import rebrickable_credentials as rbc
 
 shelves_dir = "shelves/"
+shelf_flush_every = 1000    # assignments between syncs of a shelf in a batch
+
+# storage of the shelves: 'shelve' for one dbm file per shelf, or 'sqlite' 
+# for indexed tables in a single SQLite database
+
+shelf_backend = 'shelve'
+sqlite_file = shelves_dir + 'lego.sqlite'
+
+snapshot_dir = shelves_dir + "snapshot/"    # merged collection snapshots
 
 element_img_dir = "img/elements/"
 set_img_dir = "img/sets/"
+img_manifest_file = "img/manifest.json"
+img_workers = 8         # concurrent image downloads
 box_html_dir = "html/boxes/"
 part_html_dir = "html/parts/"
 
 part_box_csv_file = "part_box.csv"
 
+csv_dump_dir = "csv/"   # Rebrickable CSV downloads (colors.csv.gz, ...)
+
+# written by a build from the CSV downloads, whose element ids are not those
+# of the API, so that sync_collection refuses to sync those shelves
+
+csv_build_file = shelves_dir + "csv.build"
+buildable_sets_shown = 50    # most complete sets listed by the menu
+
 api_key = rbc.api_key
 user_token = rbc.user_token
 list_id = rbc.list_id
 
+api_base_url = 'https://rebrickable.com/api/v3/'
+
+# Rebrickable.com throttles the API, so all the requests go through a shared
+# token bucket: rate_limit tokens per second, at most rate_burst at once
+
+rate_limit = 1.0
+rate_burst = 3
+fetch_workers = 4       # number of sets fetched concurrently
+
+page_size = 1000        # results per page, the maximum Rebrickable.com allows
+request_timeout = 30    # seconds
+max_retries = 5         # retries of a request that got a 429 or 5XX response
+retry_backoff = 1.0     # seconds before the first retry, doubled on each one
+
+# checkpoints of a build from Rebrickable.com, to resume it if interrupted
+# (see rebrickable_journal.py)
+
+fetch_journal_file = shelves_dir + "fetch.journal"
+
+# on-disk cache of the API responses that rarely change: seconds each 
+# endpoint's responses are served without asking Rebrickable.com again;
+# the endpoints not listed are never cached
+
+cache_dir = shelves_dir + "cache/"
+cache_max_bytes = 256 * 1024 * 1024
+cache_ttl = {'lego/colors': 30 * 24 * 3600,
+             'lego/themes': 30 * 24 * 3600,
+             'lego/part_categories': 30 * 24 * 3600,
+             'lego/sets': 30 * 24 * 3600,
+             'lego/sets/parts': 90 * 24 * 3600}
+
 jinja2_template_dir = 'html/templates'
+jinja2_cache_dir = shelves_dir + "jinja2/"     # compiled templates
 boxes_template_file = "boxes.html"
 box_template_file = "box.html"
 sets_template_file = "sets.html"
@@ -30,3 +81,4 @@ set_template_file = "set.html"
 box_html_dir = "html/boxes/"
 part_html_dir = "html/parts/"
 set_html_dir = "html/sets/"
+html_manifest_file = "manifest.json"   # in each html directory
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+
+# lego_metrics.py
+#
+# lightweight instrumentation of a run of the application: wall time per
+# phase and counters (HTTP requests and bytes per endpoint, shelf gets, sets
+# and syncs, merged rows, rendered pages...), reported at the end of the run
+# as a summary and optionally as JSON
+#
+#   with lmetrics.phase('merge_collection'):
+#       ...
+#   lmetrics.count('merge_collection.rows', len(df))
+#   ...
+#   lmetrics.report('metrics.json')
+#
+# the phases can also be profiled with cProfile, one .prof file per call of
+# an outermost phase (cProfile profilers can't be nested)
+
+global debug
+
+debug = 1
+
+
+import os
+import json
+import time
+import functools
+import threading
+import contextlib
+
+
+lock = threading.Lock()
+
+phases = {}     # name : {'calls': <int>, 'seconds': <float>}
+counters = {}   # name : <int or float>
+stack = []      # names of the phases running in the main thread
+
+profile_dir = None  # if set, each outermost phase is profiled to
+                    # <profile_dir>/<phase>-<call>.prof (see enable_profiling)
+profiler = None
+
+
+def enable_profiling(directory):
+    global profile_dir
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    profile_dir = directory
+
+
+def count(name, n=1):
+    '''
+    # adds n to the counter name; safe to call from any thread
+    '''
+    with lock:
+        counters[name] = counters.get(name, 0) + n
+
+
+@contextlib.contextmanager
+def phase(name):
+    '''
+    # context manager timing its block as the phase name; nested phases are
+    # named <outer phase>/<name>
+    #
+    # the phases must be opened in the main thread
+    '''
+    global profiler
+    full_name = '/'.join(stack + [name])
+    stack.append(name)
+    prof = None
+    if profile_dir is not None and profiler is None:
+        import cProfile
+        prof = profiler = cProfile.Profile()
+        prof.enable()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        if prof is not None:
+            prof.disable()
+            profiler = None
+            with lock:
+                n = phases.get(full_name, {'calls': 0})['calls'] + 1
+            prof.dump_stats(os.path.join(profile_dir, '%s-%d.prof' %
+                                         (full_name.replace('/', '.'), n)))
+        stack.pop()
+        with lock:
+            ph = phases.setdefault(full_name, {'calls': 0, 'seconds': 0.0})
+            ph['calls'] += 1
+            ph['seconds'] += seconds
+
+
+def timed(name):
+    '''
+    # decorator timing every call of a function as the phase name
+    '''
+    def decorator(f):
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            with phase(name):
+                return f(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def reset():
+    with lock:
+        phases.clear()
+        counters.clear()
+
+
+def summary():
+    '''
+    # returns the metrics recorded as a dictionary
+    '''
+    with lock:
+        return {'phases': {k: dict(v) for k, v in phases.items()},
+                'counters': dict(counters)}
+
+
+def report(file_name=None):
+    '''
+    # prints the summary of the run (with debug) and writes it as JSON to
+    # file_name, if given
+    '''
+    data = summary()
+    if debug and (data['phases'] or data['counters']):
+        print ('Phases:')
+        for name, ph in sorted(data['phases'].items()):
+            print ('  %-44s %5d %10.3f s' % (name, ph['calls'],
+                                             ph['seconds']))
+        print ('Counters:')
+        for name, n in sorted(data['counters'].items()):
+            print ('  %-44s %16s' % (name,
+                                     '%.3f' % n if isinstance(n, float)
+                                     else n))
+    if file_name:
+        with open(file_name + '.tmp', 'w') as f:
+            json.dump(data, f, indent=1, sort_keys=True)
+        os.replace(file_name + '.tmp', file_name)
+    return data
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+
+# lego_render.py
+#
+# renders the html pages of the collection from the Jinja2 templates in
+# lconf.jinja2_template_dir, in this process or in a pool of processes
+
+import os
+import json
+import hashlib
+
+import lego_conf as lconf
+
+
+env = None     # Jinja2 environment of this process, see get_env()
+
+
+def get_env():
+    '''
+    # returns the Jinja2 environment of this process; the templates are
+    # compiled once and their bytecode kept in lconf.jinja2_cache_dir, so the
+    # following processes only parse a template again after it changes
+    '''
+    global env
+    if env is None:
+        from jinja2 import Environment, FileSystemLoader, \
+                           FileSystemBytecodeCache, select_autoescape
+        if not os.path.isdir(lconf.jinja2_cache_dir):
+            os.makedirs(lconf.jinja2_cache_dir, exist_ok=True)
+        env = Environment(
+            loader=FileSystemLoader(lconf.jinja2_template_dir),
+            bytecode_cache=FileSystemBytecodeCache(lconf.jinja2_cache_dir),
+            autoescape=select_autoescape(['html', 'xml'])
+        )
+    return env
+
+
+def render_page(task):
+    '''
+    # renders a page; task is a tuple (template file, html file, context)
+    #
+    # the page is streamed to a temporary file that is then renamed, so the
+    # whole html is never held in memory and no half written page is ever
+    # left behind
+    #
+    # returns the html file name
+    '''
+    template_file, file_name, context = task
+    template = get_env().get_template(template_file)
+    tmp = '%s.%d.tmp' % (file_name, os.getpid())
+    with open(tmp, mode="w", encoding='utf-8') as file_a:
+        template.stream(**context).dump(file_a)
+    os.replace(tmp, file_name)
+    return file_name
+
+
+def template_mtimes():
+    return {f : os.path.getmtime(os.path.join(lconf.jinja2_template_dir, f))
+            for f in sorted(os.listdir(lconf.jinja2_template_dir))}
+
+
+class Manifest:
+    """
+    # manifest of the pages rendered in an html directory, saved in its
+    # lconf.html_manifest_file:
+    #
+    # { 'inputs' : <fingerprint of everything the pages depend on>,
+    #   'pages'  : { <html file> : <hash of its template, the template
+    #                               mtime and its context> }
+    # }
+    """
+
+    def __init__(self, html_dir):
+        self.file_name = html_dir + lconf.html_manifest_file
+        try:
+            with open(self.file_name, 'r') as f:
+                self.data = json.load(f)
+        except (IOError, ValueError):
+            self.data = {'inputs': None, 'pages': {}}
+
+    def inputs_hash(self, fingerprint):
+        return hashlib.sha1(json.dumps([fingerprint, template_mtimes()])
+                            .encode('utf-8')).hexdigest()
+
+    def up_to_date(self, fingerprint):
+        '''
+        # True if the pages were rendered from the same collection 
+        # fingerprint and templates, so there is nothing to render
+        '''
+        return self.data['inputs'] == self.inputs_hash(fingerprint)
+
+    def changed(self, tasks):
+        '''
+        # returns the tasks whose page is missing or has a different hash,
+        # deletes the pages in the manifest not in tasks, and records the
+        # new hashes (see save())
+        '''
+        mtimes = template_mtimes()
+        pages = {}
+        todo = []
+        for task in tasks:
+            template_file, file_name, context = task
+            pages[file_name] = hashlib.sha1(json.dumps(
+                    [template_file, mtimes[template_file], context], 
+                    sort_keys=True, default=str).encode('utf-8')).hexdigest()
+            if self.data['pages'].get(file_name) != pages[file_name] or \
+               not os.path.isfile(file_name):
+                todo.append(task)
+        for file_name in self.data['pages'].keys():
+            if file_name not in pages and os.path.isfile(file_name):
+                os.unlink(file_name)
+        self.data['pages'] = pages
+        return todo
+
+    def save(self, fingerprint):
+        self.data['inputs'] = self.inputs_hash(fingerprint)
+        with open(self.file_name + '.tmp', 'w') as f:
+            json.dump(self.data, f, indent=0, sort_keys=True)
+        os.replace(self.file_name + '.tmp', self.file_name)
+
+
+def render_pages(tasks, jobs=1):
+    '''
+    # renders the list of tasks (see render_page), with jobs processes if
+    # jobs > 1, each of them with its own Jinja2 environment
+    #
+    # returns the list of html file names, in the order of tasks
+    '''
+    if jobs <= 1 or len(tasks) <= 1:
+        return [render_page(task) for task in tasks]
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        return list(pool.map(render_page, tasks,
+                             chunksize=max(1, len(tasks) // (jobs * 4))))
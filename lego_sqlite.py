@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+
+# lego_sqlite.py
+#
+# implements the class SqliteShelf, a SQLite storage backend for the Lego
+# shelves with the same interface as the shelve.Shelf objects LegoShelf uses
+
+import sqlite3
+import json
+import collections.abc
+
+
+# one connection per database file, shared by all the shelves stored in it,
+# so that the writes of one shelf don't lock the others out
+
+connections = {}    # file_name : [connection, number of open shelves]
+
+
+def connect(file_name):
+    if file_name not in connections:
+        con = sqlite3.connect(file_name)
+        con.execute('PRAGMA journal_mode=WAL')
+        con.execute('PRAGMA synchronous=NORMAL')
+        connections[file_name] = [con, 0]
+    connections[file_name][1] += 1
+    return connections[file_name][0]
+
+
+def disconnect(file_name):
+    connections[file_name][1] -= 1
+    if connections[file_name][1] == 0:
+        con = connections.pop(file_name)[0]
+        con.commit()
+        con.close()
+
+
+# conversions between the Python values and the SQLite columns, by column
+# type; the types not listed are stored as they are
+
+to_sql = {'BOOLEAN': lambda v: None if v is None else int(v),
+          'JSON': json.dumps}
+from_sql = {'BOOLEAN': lambda v: None if v is None else bool(v),
+            'JSON': json.loads}
+
+
+class SqliteShelf(collections.abc.MutableMapping):
+    """
+    # stores the records of a shelf in a SQLite table with one typed column
+    # per record field
+    #
+    # columns        : ((<field>, <SQLite type>), ...)
+    # indexes        : fields with an index
+    # mapping_fields : {<field> : (<key column>, <value column>)} fields
+    #                  holding a dictionary, stored as rows of their own
+    #                  table <table>_<field> (key, <key column>,
+    #                  <value column>), indexed on both
+    #
+    # like shelve.open(..., writeback=True), the records read are cached and
+    # written back on sync(), so they can be modified in place
+    """
+
+    def __init__(self, file_name, table, record_class, columns, indexes=(),
+                 mapping_fields=None):
+        self.file_name = file_name
+        self.table = table
+        self.record_class = record_class
+        self.columns = columns
+        if mapping_fields is None:
+            mapping_fields = {}
+        self.mapping_fields = mapping_fields
+        self.cache = {}
+        self.con = connect(file_name)
+
+        cols = ', '.join('"%s" %s' % c for c in columns)
+        self.con.execute('CREATE TABLE IF NOT EXISTS %s '
+                         '(key TEXT PRIMARY KEY, %s)' % (table, cols))
+        for field in indexes:
+            self.con.execute('CREATE INDEX IF NOT EXISTS %s_%s ON %s ("%s")'
+                             % (table, field, table, field))
+        for field, (k, v) in mapping_fields.items():
+            child = table + '_' + field
+            self.con.execute('CREATE TABLE IF NOT EXISTS %s '
+                             '(key TEXT, %s, %s)' % (child, k, v))
+            for col in ('key', k.split()[0]):
+                self.con.execute('CREATE INDEX IF NOT EXISTS %s_%s ON %s (%s)'
+                                 % (child, col, child, col))
+
+    def __len__(self):
+        return self.con.execute('SELECT COUNT(*) FROM %s' % self.table)\
+                .fetchone()[0]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def keys(self):
+        return [r[0] for r in
+                self.con.execute('SELECT key FROM %s' % self.table)]
+
+    def __contains__(self, key):
+        if key in self.cache:
+            return True
+        return self.con.execute('SELECT 1 FROM %s WHERE key = ?' %
+                                self.table, (key,)).fetchone() is not None
+
+    def __getitem__(self, key):
+        if key in self.cache:
+            return self.cache[key]
+        fields = [c[0] for c in self.columns]
+        row = self.con.execute('SELECT %s FROM %s WHERE key = ?' %
+                               (', '.join('"%s"' % f for f in fields),
+                                self.table), (key,)).fetchone()
+        if row is None:
+            raise KeyError(key)
+        record = self.record_class.__new__(self.record_class)
+        for (field, sql_type), value in zip(self.columns, row):
+            record[field] = from_sql.get(sql_type, lambda v: v)(value)
+        for field, (k, v) in self.mapping_fields.items():
+            record[field] = dict(self.con.execute(
+                    'SELECT %s, %s FROM %s_%s WHERE key = ?' %
+                    (k.split()[0], v.split()[0], self.table, field), (key,)))
+        self.cache[key] = record
+        return record
+
+    def __setitem__(self, key, record):
+        self.cache[key] = record
+        self._write(key, record)
+
+    def __delitem__(self, key):
+        self.cache.pop(key, None)
+        self.con.execute('DELETE FROM %s WHERE key = ?' % self.table, (key,))
+        for field in self.mapping_fields.keys():
+            self.con.execute('DELETE FROM %s_%s WHERE key = ?' %
+                             (self.table, field), (key,))
+
+    def _write(self, key, record):
+        values = [to_sql.get(sql_type, lambda v: v)(record[field])
+                  for field, sql_type in self.columns]
+        self.con.execute('INSERT OR REPLACE INTO %s (key, %s) VALUES (?, %s)'
+                         % (self.table,
+                            ', '.join('"%s"' % c[0] for c in self.columns),
+                            ', '.join('?' * len(self.columns))),
+                         [key] + values)
+        for field, (k, v) in self.mapping_fields.items():
+            child = self.table + '_' + field
+            self.con.execute('DELETE FROM %s WHERE key = ?' % child, (key,))
+            self.con.executemany('INSERT INTO %s VALUES (?, ?, ?)' % child,
+                                 ((key, ek, ev) for ek, ev in
+                                  record[field].items()))
+
+    def sync(self):
+        for key, record in self.cache.items():
+            self._write(key, record)
+        self.cache = {}
+        self.con.commit()
+
+    def close(self):
+        if self.con is None:
+            return
+        self.sync()
+        self.con = None
+        disconnect(self.file_name)
@@ -4,284 +4,670 @@
 #
 # implements the class Rebrickable as an interface to rebrickable.com API V3
 
-global debug, sleep_time
+global debug
 
 debug = 1
-sleep_time = 0.5    # set to half a second to avoid that the requests to 
-                    # Rebrickable.com are throttled
 
 
 import requests
+import requests.adapters
 import time
 import os
+import json
+import random
+import threading
+import email.utils
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import lego as lg
 import lego_conf as lconf
+import lego_metrics as lmetrics
+import rebrickable_cache as rbcache
+import rebrickable_journal as rbjournal
+
+
+retry_statuses = (429, 500, 502, 503, 504)
+
+
+class TokenBucket:
+    """
+    # thread safe token bucket to avoid that the requests to Rebrickable.com
+    # are throttled
+    #
+    # the bucket holds up to burst tokens and is refilled with rate tokens
+    # per second; acquire() blocks until a token is available
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.stamp = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, 
+                                  self.tokens + (now - self.stamp) * self.rate)
+                self.stamp = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            lmetrics.count('http.throttle_seconds', wait)
+            time.sleep(wait)
+
+
+# one limiter for the whole process, shared by all the Rebrickable objects
+# and fetch workers
+
+limiter = TokenBucket(lconf.rate_limit, lconf.rate_burst)
+
+
+def retry_after(r):
+    '''
+    # returns the seconds to wait according to the Retry-After header of the 
+    # response r (either a number of seconds or an HTTP date), or 0
+    '''
+    if r is None or 'Retry-After' not in r.headers:
+        return 0
+    value = r.headers['Retry-After']
+    try:
+        return max(0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+        return max(0, when.timestamp() - time.time())
+    except (TypeError, ValueError):
+        return 0
+
+
+def unreachable(e):
+    '''
+    # True if the RequestException e means Rebrickable.com couldn't be
+    # reached: a connection error, a timeout or a 5XX response that was
+    # still failing after the retries
+    '''
+    if isinstance(e, (requests.exceptions.ConnectionError,
+                      requests.exceptions.Timeout)):
+        return True
+    return isinstance(e, requests.exceptions.HTTPError) and \
+           e.response is not None and e.response.status_code >= 500
+
+
+def inventory_line(i):
+    '''
+    # returns the fields of a result of lego/sets/{set_num}/parts used by 
+    # add_sets, which are all that the journal keeps of it
+    '''
+    return {'id': i['id'],
+            'inv_part_id': i['inv_part_id'],
+            'quantity': i['quantity'],
+            'part': {k: i['part'][k] for k in ('part_num', 'name', 
+                                               'part_cat_id', 'part_url',
+                                               'part_img_url')},
+            'color': {'id': i['color']['id']}}
+
+
+def print_error(e):
+    '''
+    # prints a requests exception with the detail sent by Rebrickable.com
+    '''
+    detail = None
+    if getattr(e, 'response', None) is not None:
+        try:
+            detail = e.response.json()['detail']
+        except (ValueError, KeyError, TypeError):
+            detail = e.response.text
+    print ('An error occurred: %s\n' % e , 'Detail:' , detail)
 
 
 class Rebrickable:
     """
     # provides an interface to rebrickable.com API v3
+    #
+    # all the requests go through one pooled keep-alive session, are 
+    # throttled by the shared limiter and retried on 429 and 5XX responses
+    #
+    # the responses of the catalogue endpoints are kept in a ResponseCache
+    # (see rebrickable_cache.py) and revalidated when their TTL expires
+    #
+    # self.stats holds, per endpoint, the number of requests, retries and 
+    # cache hits and the accumulated latency in seconds
+    #
+    # base_url is the root of the API, lconf.api_base_url by default
     """
     
+    def __init__(self, base_url=None):
+        self.api_url = base_url or lconf.api_base_url
+        self.session = requests.Session()
+        # the sets and the images are fetched by threads sharing the session
+        adapter = requests.adapters.HTTPAdapter(
+                pool_connections=2, 
+                pool_maxsize=max(lconf.fetch_workers, lconf.img_workers))
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.auth = {'Authorization': 'key ' + lconf.api_key}
+        self.stats = {}
+        self.stats_lock = threading.Lock()
+        self.cache = rbcache.ResponseCache()
+
+    def _count(self, endpoint, seconds=0.0, retry=False, hit=False):
+        lmetrics.count('http.%s.%s' % (endpoint, 
+                                       'cache_hits' if hit else 'requests'))
+        with self.stats_lock:
+            st = self.stats.setdefault(endpoint, 
+                                       {'requests': 0, 'retries': 0, 
+                                        'cache_hits': 0, 'seconds': 0.0})
+            if hit:
+                st['cache_hits'] += 1
+            else:
+                st['requests'] += 1
+                st['retries'] += retry
+                st['seconds'] += seconds
+
+    def _get(self, endpoint, url, params=None, throttle=True):
+        '''
+        # returns the response to GET url, from the cache if the endpoint is
+        # cacheable and the cached response is still fresh
+        #
+        # a stale cached response is revalidated with a conditional request,
+        # and served as is if Rebrickable.com can't be reached or keeps 
+        # answering 5XX; a 4XX response (the resource was deleted, or the key
+        # is no longer authorised) is raised, not hidden by the cache
+        '''
+        entry, fresh = self.cache.lookup(endpoint, url, params)
+        if fresh:
+            self._count(endpoint, hit=True)
+            return self.cache.response(entry)
+        try:
+            r = self._request(endpoint, url, params, throttle,
+                              self.cache.conditional_headers(entry))
+        except requests.exceptions.RequestException as e:
+            if entry is None or not unreachable(e):
+                raise
+            if debug:
+                print ('Serving stale cached response for', url)
+            self._count(endpoint, hit=True)
+            return self.cache.response(entry)
+        if r.status_code == 304:    # not modified
+            self._count(endpoint, hit=True)
+            return self.cache.response(entry, revalidated=True)
+        self.cache.store(endpoint, url, params, r)
+        return r
+
+    def _request(self, endpoint, url, params=None, throttle=True, 
+                 headers=None):
+        '''
+        # GETs url through the pooled session and returns the response
+        #
+        # endpoint is the name used to account the request in self.stats
+        # throttle is False for requests that don't go to the API (images),
+        # which are sent without the API key: only the API requests carry
+        # the Authorization header
+        #
+        # connection errors, 429 and 5XX responses are retried up to 
+        # lconf.max_retries times with jittered exponential backoff, waiting 
+        # at least what the Retry-After header says
+        #
+        # raises requests.exceptions.RequestException if it keeps failing or
+        # on any other 4XX response
+        '''
+        if throttle:
+            headers = dict(headers or {}, **self.auth)
+        attempt = 0
+        while True:
+            if throttle:
+                limiter.acquire()
+            start = time.monotonic()
+            try:
+                r = self.session.get(url, params=params, headers=headers,
+                                     timeout=lconf.request_timeout)
+                error = None
+            except (requests.exceptions.ConnectionError, 
+                    requests.exceptions.Timeout) as e:
+                r = None
+                error = e
+            self._count(endpoint, time.monotonic() - start, attempt > 0)
+            
+            if r is not None:
+                lmetrics.count('http.%s.bytes' % endpoint, len(r.content))
+            if r is not None and r.status_code not in retry_statuses:
+                r.raise_for_status()
+                return r
+            if attempt == lconf.max_retries:
+                if r is not None:
+                    r.raise_for_status()
+                raise error
+            
+            delay = lconf.retry_backoff * 2 ** attempt * \
+                    random.uniform(0.5, 1.5)
+            delay = max(delay, retry_after(r))
+            if debug:
+                print ('Retrying', url, 'in %.1f seconds' % delay)
+            lmetrics.count('http.retry_sleep_seconds', delay)
+            time.sleep(delay)
+            attempt += 1
+
+    def _get_pages(self, endpoint, url, first_page=1):
+        '''
+        # generator yielding the results of all the pages of a paginated 
+        # endpoint, lconf.page_size results per page, from first_page on
+        '''
+        next_page = first_page
+        while next_page > 0:
+            payload = {'page': next_page, 'page_size': lconf.page_size}
+            r = self._get(endpoint, url, params=payload)
+            yield r.json()['results']
+            if r.json()['next']:
+                next_page += 1
+            else:
+                next_page = 0
+
+    def print_stats(self):
+        for endpoint, st in sorted(self.stats.items()):
+            print ('%-24s requests: %5d retries: %4d cached: %5d avg: %.3f s'
+                   % (endpoint, st['requests'], st['retries'], st['cache_hits'],
+                    st['seconds'] / max(1, st['requests'])))
 
     def fetch_colour_shelf(self):
         """
         #
         # calls https://rebrickable.com/api/v3/lego/colors
-        #                   ?key={api_key}&page=1
+        #                   ?page=1
         #
         # returns all colours in Rebrickable.com as a LegoColourShelf 
         # of LegoColour objects
         #
+        # returns False if some page could not be fetched
+        #
         """     
+        ok = True
         lcs = lg.LegoColourShelf()
-        next_page = 1
-        while next_page > 0:
+        with lcs.batch():
             try:
-                payload = {'key': lconf.api_key , 'page': next_page}
-                r = requests.get('https://rebrickable.com/api/v3/lego/colors', 
-                                 params=payload)
-                r.raise_for_status()    # raise exception if bad request 
-                                        # (a 4XX client error or 5XX server 
-                                        # error response)
-                for i in r.json()['results']:
-                    c = lg.LegoColour(
-                            i['id'],
-                            i['name'],
-                            i['rgb'],
-                            i['is_trans'])
-                    lcs[str(i['id'])] = c
-            except requests.exceptions.HTTPError as e:
-                print ('An error occurred: %s\n' % e , 'Detail:' , 
-                       r.json()['detail'])
-            if r.json()['next']:
-                next_page += 1
-                time.sleep(sleep_time)
-            else:
-                next_page = 0
+                for results in self._get_pages(
+                        'lego/colors', self.api_url + 'lego/colors'):
+                    for i in results:
+                        c = lg.LegoColour(
+                                i['id'],
+                                i['name'],
+                                i['rgb'],
+                                i['is_trans'])
+                        lcs[str(i['id'])] = c
+            except requests.exceptions.RequestException as e:
+                print_error(e)
+                ok = False
         
-        lcs.close() 
+        self.cache.save()
+        lcs.close()
+        return ok
 
     def fetch_theme_shelf(self):
         """
         #
         # calls https://rebrickable.com/api/v3/lego/themes
-        #                   ?key={api_key}
         #
         # returns all themes in Rebrickable.com as a LegoThemeShelf
         # of LegoTheme objects
         #
+        # returns False if some page could not be fetched
+        #
         """
         
+        ok = True
         ths = lg.LegoThemeShelf()
-        next_page = 1
-        while next_page > 0:
+        with ths.batch():
             try:
-                payload = {'key': lconf.api_key , 'page': next_page}
-                r = requests.get('https://rebrickable.com/api/v3/lego/themes', 
-                                 params=payload)
-                r.raise_for_status()
-                for i in r.json()['results']:
-                    th = lg.LegoTheme(i['id'], i['name'], i['parent_id'])
-                    ths[str(i['id'])] = th
-            except requests.exceptions.HTTPError as e:
-                print ('An error occurred: %s\n' % e , 'Detail:' , 
-                       r.json()['detail'])
-            if r.json()['next']:
-                next_page += 1
-                time.sleep(sleep_time)
-            else:
-                next_page = 0
+                for results in self._get_pages(
+                        'lego/themes', self.api_url + 'lego/themes'):
+                    for i in results:
+                        th = lg.LegoTheme(i['id'], i['name'], i['parent_id'])
+                        ths[str(i['id'])] = th
+            except requests.exceptions.RequestException as e:
+                print_error(e)
+                ok = False
         
+        self.cache.save()
         ths.close()
+        return ok
 
     def fetch_part_category_shelf(self):
         """
         # calls https://rebrickable.com/api/v3/lego/part_categories
-        #                   ?key={api_key}
         #
         # returns all part categories in Rebrickable.com as a
         # LegoPartCategoryShelf of LegoPartCategory objects
         #
+        # returns False if some page could not be fetched
+        #
         """
         
+        ok = True
         pcs = lg.LegoPartCategoryShelf()
-        next_page = 1
-        while next_page > 0:
+        with pcs.batch():
             try:
-                payload = {'key': lconf.api_key , 'page': next_page}
-                r = requests.get(
-                        'https://rebrickable.com/api/v3/lego/part_categories', 
-                        params=payload)
-                r.raise_for_status()
-                for i in r.json()['results']:
-                    pc = lg.LegoPartCategory(i['id'], i['name'])
-                    pcs[str(i['id'])] = pc
-            except requests.exceptions.HTTPError as e:
-                print ('An error occurred: %s\n' % e , 'Detail:' , 
-                       r.json()['detail'])
-            if r.json()['next']:
-                next_page += 1
-                time.sleep(sleep_time)
-            else:
-                next_page = 0
+                for results in self._get_pages(
+                        'lego/part_categories', 
+                        self.api_url + 'lego/part_categories'):
+                    for i in results:
+                        pc = lg.LegoPartCategory(i['id'], i['name'])
+                        pcs[str(i['id'])] = pc
+            except requests.exceptions.RequestException as e:
+                print_error(e)
+                ok = False
         
+        self.cache.save()
         pcs.close()
+        return ok
 
-    
-    def fetch_main_shelves(self):
+    def fetch_set_list(self):
         '''
-        # Fetches the parts, elements and sets shelves
+        # calls https://rebrickable.com/api/v3/users/{user_token}/setlists/
+        #                   {list_id}/sets
+        #
+        # returns a dictionary <set_num:qty> with all the user sets
+        #
+        # raises requests.exceptions.RequestException if the list can't be
+        # fetched, as an incomplete list would make the collection incomplete
         '''
         
-        ps = lg.LegoPartShelf()
-        es = lg.LegoElementShelf()
-        us = lg.LegoSetShelf()
-        
-        # first get a dictionary <set_num:qty> with all the user sets
-        
         sd = {}
         
-        next_page = 1
-        while next_page > 0:
-            try:
-                payload = {'key': lconf.api_key , 'page': next_page}
-                if debug:
-                    print ('Fetching sets in list, page', next_page, ' ...')
-                r = requests.get('https://rebrickable.com/api/v3/users/' + 
-                                 lconf.user_token + '/setlists/' +
-                                 lconf.list_id + '/sets', params=payload)
-                r.raise_for_status()
-                
-                for i in r.json()['results']:
-                    sd[str(i['set']['set_num'])] = i['quantity']
-                    
-            except requests.exceptions.HTTPError as e:
-                print ('An error occurred: %s\n' % e , 'Detail:' , 
-                       r.json()['detail'])
-            if r.json()['next']:
-                next_page += 1
-                time.sleep(sleep_time)
-            else:
-                next_page = 0
-                
-        # next, for all the set numbers, call   
+        for results in self._get_pages('users/setlists/sets', 
+                                       self.api_url + 'users/' + 
+                                       lconf.user_token + '/setlists/' +
+                                       lconf.list_id + '/sets'):
+            if debug:
+                print ('Fetched', len(results), 'sets in list')
+            for i in results:
+                sd[str(i['set']['set_num'])] = i['quantity']
+        
+        return sd
+
+    def fetch_set(self, ls_num, journal):
+        '''
+        # calls 
         #
         # https://rebrickable.com/api/v3/lego/sets/{ls_num}
-        #           ?key={api_key}
-        # and
+        # and all the pages of
         # https://rebrickable.com/api/v3/lego/sets/{ls_num}/parts/
-        #           ?key={api_key}
+        #
+        # returns a tuple (set, inventory lines) with the json of the set and
+        # the list of results of the parts pages (see inventory_line), or 
+        # None if a request failed
+        #
+        # the set and each page are checkpointed in the FetchJournal journal,
+        # and what the journal already has from a previous run is not 
+        # requested again
+        #
+        # runs in the fetch worker threads, so it doesn't touch the shelves
+        '''
         
-        for ls_num in sd.keys():
-            
-            if debug:
-                print('Fetching set :', ls_num, ' ...')
+        ls_json, pages, done = journal.fetched(ls_num)
+        if done:
+            lmetrics.count('journal.sets_resumed')
+            return (ls_json, [i for lines in pages for i in lines])
         
-            try:
-                # fetch set basic information
-                
-                payload = {'key': lconf.api_key }
-                r = requests.get('https://rebrickable.com/api/v3/lego/sets/' + 
-                                 ls_num, params=payload)
-                r.raise_for_status()
+        if debug:
+            print('Fetching set :', ls_num, ' ...')
         
-                ls_name = r.json()['name']
-                ls_year = r.json()['year']
-                ls_theme_id = r.json()['theme_id']
-                ls_num_parts = r.json()['num_parts']
-                ls_url = r.json()['set_url']
-                ls_img_url = r.json()['set_img_url']
-                
+        try:
+            # fetch set basic information
+            
+            if ls_json is None:
+                r = self._get('lego/sets', 
+                              self.api_url + 'lego/sets/' + ls_num)
+                ls_json = r.json()
+                journal.set_fetched(ls_num, ls_json)
+            
+            # now fetch the set elements, from the page after the last one 
+            # in the journal
             
-                # now fetch the set elements
+            lmetrics.count('journal.pages_resumed', len(pages))
+            for results in self._get_pages('lego/sets/parts', 
+                                           self.api_url + 'lego/sets/' + 
+                                           ls_num + '/parts/',
+                                           len(pages) + 1):
+                lines = [inventory_line(i) for i in results]
+                journal.page_fetched(ls_num, len(pages) + 1, lines)
+                pages.append(lines)
+            journal.set_done(ls_num)
+            
+            return (ls_json, [i for lines in pages for i in lines])
+        
+        except requests.exceptions.RequestException as e:
+            print_error(e)
+            return None
+
+    def add_sets(self, sd, ps, es, us, journal=None):
+        '''
+        # fetches the sets in the dictionary sd <set_num:qty> and adds them,
+        # their parts and their elements to the shelves ps, es and us
+        #
+        # journal is the FetchJournal checkpointing the fetch, if any; when 
+        # it was resumed the elements replace those in es, as es may already
+        # have some of them from the interrupted run
+        #
+        # the sets are fetched concurrently by lconf.fetch_workers threads,
+        # all of them throttled by the shared limiter; the shelves are only
+        # written from this thread, and synced every lconf.shelf_flush_every
+        # assignments
+        #
+        # the parts and elements are accumulated in memory, summing the 
+        # quantities of the elements, and written once at the end, so each
+        # distinct part and element is written once however many sets it is
+        # in
+        #
+        # returns the list of set numbers that could not be fetched
+        '''
+        
+        if journal is None:
+            journal = rbjournal.FetchJournal(None)
+        
+        failed = []
+        parts = {}      # part_num : LegoPart
+        elements = {}   # str(element_id) : LegoElement
+        
+        with us.batch(lconf.shelf_flush_every), \
+             ThreadPoolExecutor(max_workers=lconf.fetch_workers) as pool:
+            futures = {pool.submit(self.fetch_set, ls_num, journal): ls_num 
+                       for ls_num in sd.keys()}
+            for f in as_completed(futures):
+                ls_num = futures[f]
+                fetched = f.result()
+                if fetched is None:     # the set could not be fetched
+                    failed.append(ls_num)
+                    continue
+                ls_json, lines = fetched
                 
                 ls_ed = {} # dictionary to store <element_id, qty> pairs
                             # to create the LegoSet object
                 
-                next_page = 1
-                while next_page > 0:
-                    payload = {'key': lconf.api_key , 'page': next_page}
-                    if debug:
-                        print ('Fetching elements, page', next_page, 
-                               ' ...')
-                    r = requests.get(
-                            'https://rebrickable.com/api/v3/lego/sets/'
-                            + ls_num + '/parts/', params=payload)
-                    r.raise_for_status()
-                    for i in r.json()['results']:
-                        lp = lg.LegoPart( # constructs the part
-                                i['part']['part_num'],
-                                i['part']['name'],
-                                i['part']['part_cat_id'],
-                                i['part']['part_url'],
-                                i['part']['part_img_url']) 
-                            
-                        ps[i['part']['part_num']] = lp  # add the part to 
-                                                        # shelf
-                        le = lg.LegoElement( # constructs the element
+                for i in lines:
+                    parts[i['part']['part_num']] = lg.LegoPart(
+                            i['part']['part_num'],
+                            i['part']['name'],
+                            i['part']['part_cat_id'],
+                            i['part']['part_url'],
+                            i['part']['part_img_url']) 
+                    
+                    qty = i['quantity'] * sd[ls_num]    # multiply by qty
+                                                        # of sets
+                    le = elements.get(str(i['id']))
+                    if le is None:
+                        elements[str(i['id'])] = lg.LegoElement(
                                 i['id'],
                                 i['inv_part_id'],
                                 i['part']['part_num'],
                                 i['color']['id'],
                                 i['part']['part_img_url'],
-                                i['quantity'] * sd[ls_num]) # multiply by
-                                                            # qty of sets
-                        
-                        es[str(i['id'])] = le # add the element to the shelf
-                        ls_ed[i['id']] = i['quantity']  # attribute of the 
-                                                        # LegoSet object
-
-                    if r.json()['next']:
-                        next_page += 1
-                        time.sleep(sleep_time)
+                                qty)
                     else:
-                        next_page = 0
-            
+                        le.set_quantity(le.get_quantity() + qty)
+                    ls_ed[i['id']] = i['quantity']  # attribute of the 
+                                                    # LegoSet object
+        
                 ls = lg.LegoSet(
                         ls_num,
-                        ls_name,
-                        ls_year,
-                        ls_theme_id,
-                        ls_num_parts,
-                        ls_url,
-                        ls_img_url,
+                        ls_json['name'],
+                        ls_json['year'],
+                        ls_json['theme_id'],
+                        ls_json['num_parts'],
+                        ls_json['set_url'],
+                        ls_json['set_img_url'],
                         ls_ed, # dictionary <element_id, qty>
                         sd[ls_num]) # qty of sets
                 us[str(ls_num)] = ls # add the lego set to the shelf
-            
-            except requests.exceptions.HTTPError as e:
-                print ('An error occurred: %s\n' % e , 'Detail:' , 
-                           r.json()['detail'])
+        
+        # LegoElementShelf adds the quantities to those of the elements 
+        # already in the shelf
+        
+        with ps.batch(lconf.shelf_flush_every):
+            for part_num, lp in parts.items():
+                ps[part_num] = lp
+        store = es.replace if journal.resumed else es.__setitem__
+        with es.batch(lconf.shelf_flush_every):
+            for el_id, le in elements.items():
+                store(el_id, le)
+        
+        if failed:
+            print ('Sets that could not be fetched:', ', '.join(failed))
+        self.cache.save()
+        if debug:
+            print ('Added', len(sd) - len(failed), 'sets,', len(elements),
+                   'elements and', len(parts), 'parts')
+            self.print_stats()
+        
+        return failed
+
+    def fetch_main_shelves(self, resume=False, journal=None):
+        '''
+        # Fetches the parts, elements and sets shelves
+        #
+        # the fetch is checkpointed in journal, a FetchJournal, or in its own
+        # journal in lconf.fetch_journal_file, loaded first with resume; 
+        # then the set list of the interrupted run is used and its sets 
+        # and pages already fetched are not requested again
+        #
+        # the phase 'main_shelves' is recorded in the journal once every set
+        # was fetched, and its own journal removed
+        #
+        # returns the list of set numbers that could not be fetched
+        '''
+        
+        own = journal is None
+        if own:
+            journal = rbjournal.FetchJournal(lconf.fetch_journal_file, 
+                                             resume)
+        if 'main_shelves' in journal.phases:
+            return []
+        
+        # first get a dictionary <set_num:qty> with all the user sets, then
+        # fetch all of them
+        
+        if journal.set_list is None:
+            journal.start(self.fetch_set_list())
+        
+        ps = lg.LegoPartShelf()
+        es = lg.LegoElementShelf()
+        us = lg.LegoSetShelf()
+        
+        failed = self.add_sets(journal.set_list, ps, es, us, journal)
         
         ps.close()
         es.close()
         us.close()
+        
+        if not failed:
+            journal.phase_done('main_shelves')
+        if own and not failed:
+            journal.remove()
+        elif own:
+            journal.close()
+            print ('Run fetch_main_shelves(resume=True) to fetch the rest')
+        return failed
 
 
     def fetch_img (self, remote_url, local_url) :
         """
         # fetches a remote file to a local destination
+        #
+        # the file is written to a temporary file that is then renamed, so 
+        # an interrupted download never leaves a truncated file behind, and
+        # the temporary file is removed if the write or the rename fails
+        #
+        # returns True if local_url exists afterwards
         """
+        if remote_url is None:  # no image URL
+            return False
         if not os.path.isfile(local_url):
             try:
-                r = requests.get(remote_url)
-                with open(local_url, 'wb') as f:
+                r = self._get('img', remote_url, throttle=False)
+            except requests.exceptions.RequestException as e:
+                print_error(e)
+                return False
+            tmp = local_url + '.%d.tmp' % threading.get_ident()
+            try:
+                with open(tmp, 'wb') as f:
                     f.write(r.content)
-            except requests.exceptions.HTTPError as e:
-                print ('An error occurred: %s\n' % e , 'Detail:' , 
-                           r.json()['detail'])
+                os.replace(tmp, local_url)
             except IOError:
                 print ('Error creating %s\n' % local_url)
-    
-    
-            
-            
-        
-        
+                if os.path.isfile(tmp):
+                    os.unlink(tmp)
+                return False
+        return True
+
+    def fetch_imgs(self, imgs):
+        """
+        # fetches the images in the dictionary imgs <remote_url:local_url>
+        # with lconf.img_workers threads
+        #
+        # lconf.img_manifest_file keeps the local files already downloaded, 
+        # so that they are skipped without checking them one by one; when 
+        # there is no manifest it is built from the image directories
+        """
+        manifest = self._load_img_manifest()
+        todo = {remote_url: local_url for remote_url, local_url in 
+                imgs.items() 
+                if remote_url is not None and local_url not in manifest}
+        if debug:
+            print ('Fetching', len(todo), 'images,', len(imgs) - len(todo), 
+                   'already fetched')
         
+        with ThreadPoolExecutor(max_workers=lconf.img_workers) as pool:
+            futures = {pool.submit(self.fetch_img, remote_url, local_url): 
+                       local_url for remote_url, local_url in todo.items()}
+            for f in as_completed(futures):
+                if f.result():
+                    manifest.add(futures[f])
         
+        path = lconf.img_manifest_file
+        try:
+            if os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path + '.tmp', 'w') as f:
+                json.dump(sorted(manifest), f, indent=0)
+            os.replace(path + '.tmp', path)
+        except IOError:
+            print ('Error creating %s\n' % path)
+
+    def _load_img_manifest(self):
+        try:
+            with open(lconf.img_manifest_file, 'r') as f:
+                return set(json.load(f))
+        except (IOError, ValueError):
+            manifest = set()
+            for img_dir in (lconf.element_img_dir, lconf.set_img_dir):
+                if os.path.isdir(img_dir):
+                    manifest.update(img_dir + f for f in os.listdir(img_dir)
+                                    if not f.endswith('.tmp'))
+            return manifest
+
 
 ###############################################################################
 
@@ -297,6 +683,7 @@ if __name__ == '__main__':
         print ("4 - fetch_main_shelves()")
         print ("5 - fetch element images")
         print ("6 - fetch set images")
+        print ("7 - fetch_main_shelves(resume=True)")
         print ("s - salir")
         option = input("Selecciona una opción: ")
         if (option == "1"):
@@ -329,17 +716,22 @@ if __name__ == '__main__':
         if (option == "5"):
             print ("Has escogido 5 - fetch element images")
             els = lg.LegoElementShelf()
+            imgs = {}
             for el in els.keys():
-                print ('Fetching img for element ', el)
-                rb.fetch_img(els[el].get_img_url(), 
-                             els[el].get_local_img_url())
+                le = els[el]
+                imgs[le.get_img_url()] = le.get_local_img_url()
+            rb.fetch_imgs(imgs)
         if (option == "6"):
             print ("Has escogido 6 - fetch set images")
             ss = lg.LegoSetShelf()
+            imgs = {}
             for s in ss.keys():
-                print ('Fetching img for set ', s)
-                rb.fetch_img(ss[s].get_img_url(), 
-                             ss[s].get_local_img_url())
+                ls = ss[s]
+                imgs[ls.get_img_url()] = ls.get_local_img_url()
+            rb.fetch_imgs(imgs)
+        if (option == "7"):
+            print ("Has escogido 7 - fetch_main_shelves(resume=True)")
+            rb.fetch_main_shelves(resume=True)
         elif (option == "s"):
             break
         else:
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+
+# rebrickable_cache.py
+#
+# implements the class ResponseCache, a persistent on-disk cache of the
+# responses of the Rebrickable.com API endpoints that rarely change
+
+global debug
+
+debug = 1
+
+
+import os
+import json
+import time
+import hashlib
+import threading
+
+import lego_conf as lconf
+
+
+class CachedResponse:
+    """
+    # stands in for a requests response when the body comes from the cache
+    """
+
+    status_code = 200
+
+    def __init__(self, content):
+        self.content = content
+        self.headers = {}
+
+    def json(self):
+        return json.loads(self.content.decode('utf-8'))
+
+    def raise_for_status(self):
+        pass
+
+
+class ResponseCache:
+    """
+    # content-addressed cache of API responses in lconf.cache_dir
+    #
+    # the bodies are stored once per content in files named by their sha256,
+    # and index.json maps the sha256 of every request (url and parameters)
+    # to
+    #
+    # { 'blob'          : <sha256 of the body>,
+    #   'etag'          : <string> or None,
+    #   'last_modified' : <string> or None,
+    #   'stored'        : <time the body was fetched or revalidated>,
+    #   'used'          : <time the entry was last read>
+    # }
+    #
+    # only the endpoints in lconf.cache_ttl are cached; an entry younger than
+    # its TTL is served without any request, an older one is revalidated
+    # with If-None-Match / If-Modified-Since
+    #
+    # when the blobs grow over lconf.cache_max_bytes the least recently used
+    # entries are evicted
+    """
+
+    index_file = 'index.json'
+
+    def __init__(self, cache_dir=lconf.cache_dir):
+        self.cache_dir = cache_dir
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        self.lock = threading.Lock()
+        try:
+            with open(os.path.join(cache_dir, self.index_file), 'r') as f:
+                self.index = json.load(f)
+        except (IOError, ValueError):
+            self.index = {}
+        self.modified = False
+
+    def key(self, url, params=None):
+        params = sorted((params or {}).items())
+        return hashlib.sha256((url + '?' + json.dumps(params))
+                              .encode('utf-8')).hexdigest()
+
+    def cacheable(self, endpoint):
+        return endpoint in lconf.cache_ttl
+
+    def lookup(self, endpoint, url, params=None):
+        '''
+        # returns a tuple (entry, fresh) with the index entry of the request,
+        # or None, and whether it is still within the TTL of the endpoint
+        '''
+        if not self.cacheable(endpoint):
+            return (None, False)
+        with self.lock:
+            entry = self.index.get(self.key(url, params))
+        if entry is None:
+            return (None, False)
+        if not os.path.isfile(self._blob_path(entry['blob'])):
+            return (None, False)
+        fresh = time.time() - entry['stored'] < lconf.cache_ttl[endpoint]
+        return (entry, fresh)
+
+    def conditional_headers(self, entry):
+        headers = {}
+        if entry is not None:
+            if entry['etag']:
+                headers['If-None-Match'] = entry['etag']
+            if entry['last_modified']:
+                headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def response(self, entry, revalidated=False):
+        '''
+        # returns a CachedResponse with the body of entry
+        '''
+        with open(self._blob_path(entry['blob']), 'rb') as f:
+            content = f.read()
+        with self.lock:
+            entry['used'] = time.time()
+            if revalidated:
+                entry['stored'] = entry['used']
+            self.modified = True
+        return CachedResponse(content)
+
+    def store(self, endpoint, url, params, r):
+        '''
+        # stores the body of the response r to the request url, params
+        '''
+        if not self.cacheable(endpoint) or r.status_code != 200:
+            return
+        blob = hashlib.sha256(r.content).hexdigest()
+        path = self._blob_path(blob)
+        if not os.path.isfile(path):
+            tmp = path + '.%d.tmp' % threading.get_ident()
+            with open(tmp, 'wb') as f:
+                f.write(r.content)
+            os.replace(tmp, path)
+        now = time.time()
+        with self.lock:
+            self.index[self.key(url, params)] = {
+                    'blob': blob,
+                    'size': len(r.content),
+                    'etag': r.headers.get('ETag'),
+                    'last_modified': r.headers.get('Last-Modified'),
+                    'stored': now,
+                    'used': now}
+            self.modified = True
+
+    def evict(self):
+        '''
+        # removes the least recently used entries until the blobs take less
+        # than lconf.cache_max_bytes
+        '''
+        with self.lock:
+            blobs = {}
+            for entry in self.index.values():
+                blobs[entry['blob']] = max(blobs.get(entry['blob'], 0),
+                                           entry['used'])
+            sizes = {e['blob']: e['size'] for e in self.index.values()}
+            total = sum(sizes.values())
+            evicted = set()
+            for blob in sorted(blobs, key=blobs.get):
+                if total <= lconf.cache_max_bytes:
+                    break
+                if debug:
+                    print ('Evicting cached response', blob)
+                try:
+                    os.unlink(self._blob_path(blob))
+                except OSError:
+                    pass
+                total -= sizes[blob]
+                evicted.add(blob)
+            if evicted:
+                self.index = {k: e for k, e in self.index.items()
+                              if e['blob'] not in evicted}
+                self.modified = True
+
+    def save(self):
+        '''
+        # evicts the LRU entries over the size limit and writes the index
+        '''
+        self.evict()
+        with self.lock:
+            if not self.modified:
+                return
+            path = os.path.join(self.cache_dir, self.index_file)
+            with open(path + '.tmp', 'w') as f:
+                json.dump(self.index, f)
+            os.replace(path + '.tmp', path)
+            self.modified = False
+
+    def _blob_path(self, blob):
+        return os.path.join(self.cache_dir, blob)
@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+
+# rebrickable_csv.py
+#
+# implements the class RebrickableCSV, which builds the Lego shelves from the
+# database downloads of rebrickable.com (https://rebrickable.com/downloads/)
+# instead of the API
+
+global debug
+
+debug = 1
+
+
+import csv
+import gzip
+import os
+
+import lego as lg
+import lego_conf as lconf
+import rebrickable as rb
+
+
+class RebrickableCSV:
+    """
+    # loads the Rebrickable CSV files (plain or gzipped) in csv_dir:
+    #
+    #   colors.csv           id, name, rgb, is_trans
+    #   themes.csv           id, name, parent_id
+    #   part_categories.csv  id, name
+    #   parts.csv            part_num, name, part_cat_id, ...
+    #   sets.csv             set_num, name, year, theme_id, num_parts,
+    #                        img_url, ...
+    #   inventories.csv      id, version, set_num
+    #   inventory_parts.csv  inventory_id, part_num, color_id, quantity,
+    #                        is_spare, img_url
+    #   elements.csv         element_id, part_num, color_id, design_id
+    #
+    # into the same shelves and objects as the Rebrickable class, so the rest
+    # of the application can't tell where they came from
+    #
+    # only the user set list is fetched from the API
+    """
+
+    def __init__(self, csv_dir=lconf.csv_dump_dir):
+        self.csv_dir = csv_dir
+
+    def _rows(self, name):
+        '''
+        # generator yielding the rows of name.csv.gz or name.csv as
+        # dictionaries
+        '''
+        path = os.path.join(self.csv_dir, name + '.csv')
+        if os.path.isfile(path + '.gz'):
+            f = gzip.open(path + '.gz', 'rt', encoding='utf-8', newline='')
+        else:
+            f = open(path, 'r', encoding='utf-8', newline='')
+        with f:
+            for row in csv.DictReader(f):
+                yield row
+
+    def fetch_colour_shelf(self):
+        lcs = lg.LegoColourShelf()
+        with lcs.batch():
+            for row in self._rows('colors'):
+                c = lg.LegoColour(
+                        int(row['id']),
+                        row['name'],
+                        row['rgb'],
+                        row['is_trans'].lower() in ('t', 'true'))
+                lcs[row['id']] = c
+        lcs.close()
+
+    def fetch_theme_shelf(self):
+        ths = lg.LegoThemeShelf()
+        with ths.batch():
+            for row in self._rows('themes'):
+                th = lg.LegoTheme(
+                        int(row['id']),
+                        row['name'],
+                        int(row['parent_id']) if row['parent_id'] else None)
+                ths[row['id']] = th
+        ths.close()
+
+    def fetch_part_category_shelf(self):
+        pcs = lg.LegoPartCategoryShelf()
+        with pcs.batch():
+            for row in self._rows('part_categories'):
+                pc = lg.LegoPartCategory(int(row['id']), row['name'])
+                pcs[row['id']] = pc
+        pcs.close()
+
+    def _inventories(self, set_nums=None):
+        '''
+        # returns a dictionary <set_num : inventory id> with the first 
+        # version of the inventory of every set in set_nums (of every set in
+        # the CSV files if None), the version the API returns
+        '''
+        inventories = {}    # set_num : (version, inventory_id)
+        for row in self._rows('inventories'):
+            if set_nums is None or row['set_num'] in set_nums:
+                version = int(row['version'])
+                if row['set_num'] not in inventories or \
+                   version < inventories[row['set_num']][0]:
+                    inventories[row['set_num']] = (version, row['id'])
+        return {ls_num : inv_id 
+                for ls_num, (version, inv_id) in inventories.items()}
+
+    def _inventory_lines(self, inventories, to_build=False):
+        '''
+        # generator yielding (element id, set_num, part_num, colour_id, qty,
+        # img_url) for the lines of the inventories <set_num : inventory id>
+        #
+        # the element ids are the row numbers in inventory_parts.csv, as the
+        # ids of the API are the ids of those rows, which the CSV files don't
+        # have
+        #
+        # the spare parts are kept in the shelves, as the API returns them
+        # and they come in the box of the set, so they are part of the 
+        # bricks owned; with to_build they are left out, as they are not 
+        # needed to build the set
+        '''
+        set_of_inventory = {inv_id : ls_num 
+                            for ls_num, inv_id in inventories.items()}
+        for n, row in enumerate(self._rows('inventory_parts'), start=1):
+            ls_num = set_of_inventory.get(row['inventory_id'])
+            if ls_num is None or (to_build and 
+                                  row.get('is_spare', 'f').lower() 
+                                  in ('t', 'true')):
+                continue
+            yield (n, ls_num, row['part_num'], int(row['color_id']),
+                   int(row['quantity']), row.get('img_url') or None)
+
+    def inventory_lines(self, set_nums=None):
+        '''
+        # generator yielding (set_num, part_num, colour_id, qty) for the
+        # lines needed to build every set in the CSV files, or only those 
+        # in set_nums (see _inventory_lines)
+        #
+        # these are the candidate sets of lego_buildability.Buildability
+        '''
+        for el_id, ls_num, part_num, colour_id, qty, img_url in \
+                self._inventory_lines(self._inventories(set_nums), 
+                                      to_build=True):
+            yield (ls_num, part_num, colour_id, qty)
+
+    def fetch_main_shelves(self, sd=None):
+        '''
+        # Builds the parts, elements and sets shelves for the sets in the
+        # dictionary sd <set_num:qty>, by default the user set list fetched
+        # from Rebrickable.com
+        #
+        # the CSV files are streamed, keeping in memory only the rows of the
+        # sets in sd; for every set the first version of its inventory is
+        # used, as the API does
+        #
+        # the element ids are those of _inventory_lines
+        '''
+
+        if sd is None:
+            sd = rb.Rebrickable().fetch_set_list()
+
+        # the inventory of each set and its lines (element_id, set_num,
+        # part_num, colour_id, qty, img_url), spare parts included
+
+        inventories = self._inventories(sd)
+        lines = list(self._inventory_lines(inventories))
+
+        part_nums = {line[2] for line in lines}
+        part_imgs = {}
+        for line in lines:
+            part_imgs.setdefault(line[2], line[5])
+
+        design_ids = {}
+        for row in self._rows('elements'):
+            if row['part_num'] in part_nums:
+                design_id = row.get('design_id')
+                design_ids.setdefault((row['part_num'], int(row['color_id'])),
+                                      int(design_id) if design_id else None)
+
+        ps = lg.LegoPartShelf()
+        with ps.batch(lconf.shelf_flush_every):
+            for row in self._rows('parts'):
+                if row['part_num'] in part_nums:
+                    lp = lg.LegoPart(
+                            row['part_num'],
+                            row['name'],
+                            int(row['part_cat_id']),
+                            'https://rebrickable.com/parts/' + 
+                            row['part_num'] + '/',
+                            part_imgs[row['part_num']])
+                    ps[row['part_num']] = lp
+        ps.close()
+
+        es = lg.LegoElementShelf()
+        ls_eds = {ls_num : {} for ls_num in inventories.keys()}
+        with es.batch(lconf.shelf_flush_every):
+            for el_id, ls_num, part_num, colour_id, qty, img_url in lines:
+                le = lg.LegoElement(
+                        el_id,
+                        design_ids.get((part_num, colour_id)),
+                        part_num,
+                        colour_id,
+                        img_url,
+                        qty * sd[ls_num])   # multiply by qty of sets
+                es[str(el_id)] = le
+                ls_eds[ls_num][el_id] = qty
+        es.close()
+
+        us = lg.LegoSetShelf()
+        with us.batch(lconf.shelf_flush_every):
+            for row in self._rows('sets'):
+                if row['set_num'] in inventories:
+                    ls = lg.LegoSet(
+                            row['set_num'],
+                            row['name'],
+                            int(row['year']),
+                            int(row['theme_id']),
+                            int(row['num_parts']),
+                            'https://rebrickable.com/sets/' + 
+                            row['set_num'] + '/',
+                            row.get('img_url') or None,
+                            ls_eds[row['set_num']], # <element_id:qty>
+                            sd[row['set_num']])     # qty of sets
+                    us[row['set_num']] = ls
+        us.close()
+
+        missing = [ls_num for ls_num in sd.keys() if ls_num not in inventories]
+        if missing:
+            print ('Sets not found in the CSV files:', ', '.join(missing))
+        if debug:
+            print ('Loaded', len(inventories), 'sets,', len(lines),
+                   'elements and', len(part_nums), 'parts')
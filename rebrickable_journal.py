@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+
+# rebrickable_journal.py
+#
+# implements the class FetchJournal, the checkpoint journal of a build of
+# the collection from Rebrickable.com, so that a build interrupted by a
+# network failure or by killing the process resumes where it stopped
+# instead of starting again from zero
+
+global debug
+
+debug = 1
+
+
+import os
+import json
+import threading
+
+import lego_conf as lconf
+
+
+class FetchJournal:
+    """
+    # append-only journal in file_name, one JSON object per line:
+    #
+    # {'phase': <name>}                       a phase of the build completed
+    # {'set_list': {set_num: qty},
+    #  'page_size': <int>}                    the sets being fetched
+    # {'set': set_num, 'json': <json>}        the set basic information
+    # {'set': set_num, 'page': n,
+    #  'lines': [...]}                        page n of the set inventory
+    # {'set': set_num, 'done': True}          all the pages of the set fetched
+    #
+    # every record is flushed as soon as it is written, from any thread; a
+    # truncated last record (the process killed while writing it) is
+    # dropped when the journal is loaded
+    #
+    # with resume the records of the previous run are loaded: phases,
+    # set_list and the sets and pages fetched (see fetched()); otherwise the
+    # journal starts empty
+    #
+    # with file_name None nothing is written, for the fetches that can't be
+    # resumed
+    """
+
+    def __init__(self, file_name=lconf.fetch_journal_file, resume=False):
+        self.file_name = file_name
+        self.lock = threading.Lock()
+        self.phases = set()
+        self.set_list = None
+        self.sets = {}      # set_num : set json
+        self.pages = {}     # set_num : [lines of page 1, lines of page 2...]
+        self.done = set()   # set_num of the sets with all their pages
+        self.resumed = False
+        self.f = None
+        if file_name is None:
+            return
+        if resume and os.path.isfile(file_name):
+            self.load()
+        directory = os.path.dirname(file_name)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.f = open(file_name, 'a' if self.resumed else 'w',
+                      encoding='utf-8')
+
+    def load(self):
+        '''
+        # reads the records of the previous run, dropping a truncated last
+        # one, and the pages of the sets not done if they were fetched with
+        # another lconf.page_size
+        '''
+        good = 0    # offset of the end of the last complete record
+        page_size = None
+        with open(self.file_name, 'rb') as f:
+            for line in f:
+                try:
+                    record = json.loads(line.decode('utf-8'))
+                except ValueError:
+                    break
+                if not line.endswith(b'\n'):
+                    break
+                good += len(line)
+                if 'phase' in record:
+                    self.phases.add(record['phase'])
+                elif 'set_list' in record:
+                    self.set_list = record['set_list']
+                    page_size = record['page_size']
+                elif 'json' in record:
+                    self.sets[record['set']] = record['json']
+                elif 'page' in record:
+                    pages = self.pages.setdefault(record['set'], [])
+                    if record['page'] == len(pages) + 1:
+                        pages.append(record['lines'])
+                elif 'done' in record:
+                    self.done.add(record['set'])
+        with open(self.file_name, 'r+b') as f:
+            f.truncate(good)
+        if page_size != lconf.page_size:
+            self.pages = {s: p for s, p in self.pages.items()
+                          if s in self.done}
+        self.resumed = bool(self.phases or self.set_list is not None)
+        if debug and self.resumed:
+            print ('Resuming from the journal: %d phases and %d sets done' %
+                   (len(self.phases), len(self.done)))
+
+    def write(self, record):
+        if self.f is None:
+            return
+        line = json.dumps(record, separators=(',', ':')) + '\n'
+        with self.lock:
+            self.f.write(line)
+            self.f.flush()
+
+    def phase_done(self, name):
+        self.phases.add(name)
+        self.write({'phase': name})
+
+    def start(self, set_list):
+        self.set_list = set_list
+        self.write({'set_list': set_list, 'page_size': lconf.page_size})
+
+    def set_fetched(self, set_num, set_json):
+        self.write({'set': set_num, 'json': set_json})
+
+    def page_fetched(self, set_num, page, lines):
+        self.write({'set': set_num, 'page': page, 'lines': lines})
+
+    def set_done(self, set_num):
+        self.write({'set': set_num, 'done': True})
+
+    def fetched(self, set_num):
+        '''
+        # returns a tuple (set json or None, list of the pages of lines
+        # fetched, done) of set_num from the previous run, and forgets them,
+        # as each set is only asked for once
+        '''
+        with self.lock:
+            return (self.sets.pop(set_num, None),
+                    self.pages.pop(set_num, []),
+                    set_num in self.done)
+
+    def close(self):
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+
+    def remove(self):
+        '''
+        # closes and deletes the journal, once the build is complete
+        '''
+        self.close()
+        if self.file_name is not None and os.path.isfile(self.file_name):
+            os.unlink(self.file_name)
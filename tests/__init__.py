@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+
+# tests/__init__.py
+#
+# unit tests of lego-collection, run from the repository root with
+#
+#   python -m unittest
+#
+# or python -m pytest tests
+#
+# lego_conf imports the rebrickable_credentials.py of the user, which the
+# tests don't use: a dummy module stands in for it when it doesn't exist
+
+import os
+import sys
+import types
+import tempfile
+import unittest
+
+try:
+    import rebrickable_credentials
+except ImportError:
+    rebrickable_credentials = types.ModuleType('rebrickable_credentials')
+    rebrickable_credentials.api_key = 'test'
+    rebrickable_credentials.user_token = 'test'
+    rebrickable_credentials.list_id = 0
+    sys.modules['rebrickable_credentials'] = rebrickable_credentials
+
+
+class TempDirTestCase(unittest.TestCase):
+    """
+    # runs each test in a new temporary directory, where the relative paths
+    # of lego_conf (shelves/, img/...) are created
+    """
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.TemporaryDirectory()
+        os.chdir(self.tmp.name)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+
+# tests/test_lego_records.py
+#
+# pickling of the LegoRecord objects and migration of the shelves whose
+# records were pickled as dictionaries
+
+import copyreg
+import os
+import pickle
+import pickletools
+import shelve
+import unittest
+
+from tests import TempDirTestCase
+
+import lego as lg
+import lego_conf as lconf
+
+lg.debug = 0
+
+
+def colour():
+    return lg.LegoColour(4, 'Red', 'C91A09', False)
+
+
+def element():
+    return lg.LegoElement(300521, 3001, '3001', 4,
+                          'https://cdn.rebrickable.com/media/parts/3001.jpg',
+                          6)
+
+
+def lego_set():
+    # ids not sorted, far apart and close together, to exercise the deltas
+    return lg.LegoSet('6020-1', 'Magic Shop', 1993, 198, 4,
+                      'https://rebrickable.com/sets/6020-1/', None,
+                      {5000: 2, 5001: 1, 17: 3, 2 ** 40: 1}, 2)
+
+
+def dict_pickle(cls, d):
+    '''
+    # pickles the dictionary d the way the records of class cls were
+    # pickled when they were dict subclasses: a new object of the class,
+    # then its items
+    '''
+    class Old(dict):
+        def __reduce_ex__(self, protocol):
+            return (copyreg._reconstructor, (cls, object, None), None, None,
+                    iter(self.items()))
+    return pickle.dumps(Old(d), protocol=3)
+
+
+class RecordTest(unittest.TestCase):
+
+    def test_pickle_round_trip(self):
+        for record in (colour(), element(), lego_set()):
+            copy = pickle.loads(pickle.dumps(record))
+            self.assertIs(type(copy), type(record))
+            self.assertEqual(copy, record)
+            self.assertEqual(dict(copy.items()), dict(record.items()))
+
+    def test_pickle_is_a_tuple_without_field_names(self):
+        data = pickle.dumps(colour())
+        self.assertNotIn(b'is_trans', data)
+        self.assertNotIn(b'name', data)
+        self.assertFalse(any(op.name in ('SETITEM', 'SETITEMS')
+                             for op, arg, pos in pickletools.genops(data)))
+
+    def test_set_elements_are_packed(self):
+        ls = lego_set()
+        state = ls.__getstate__()
+        self.assertIsInstance(state[8], tuple)
+        copy = pickle.loads(pickle.dumps(ls))
+        self.assertEqual(copy.get_elements(), ls.get_elements())
+        self.assertEqual(list(copy.get_elements()), list(ls.get_elements()))
+
+    def test_behaves_as_a_dictionary(self):
+        c = colour()
+        self.assertEqual(c['is_trans'], False)
+        self.assertEqual(c.is_trans(), False)
+        self.assertEqual(list(c.keys()), ['id', 'name', 'rgb', 'is_trans'])
+        self.assertIn('rgb', c)
+        self.assertNotIn('trans', c)
+        self.assertIsNone(c.get('missing'))
+        with self.assertRaises(KeyError):
+            c['missing']
+        c['name'] = 'Bright Red'
+        self.assertEqual(c.get_name(), 'Bright Red')
+
+    def test_derived_fields_are_not_stored(self):
+        le = element()
+        self.assertEqual(le['local_img_url'],
+                         lconf.element_img_dir + '3001.jpg')
+        le['local_img_url'] = 'elsewhere.jpg'   # recomputed, not stored
+        self.assertEqual(le.get_local_img_url(),
+                         lconf.element_img_dir + '3001.jpg')
+        self.assertEqual(lego_set().get_local_img_url(),
+                         lconf.set_img_dir + 'ni.png')
+
+    def test_unknown_version(self):
+        state = (99,) + colour().__getstate__()[1:]
+        with self.assertRaises(ValueError):
+            lg.LegoColour.__new__(lg.LegoColour).__setstate__(state)
+
+    def test_dict_pickle_loads_as_record(self):
+        c = colour()
+        data = dict_pickle(lg.LegoColour, dict(c.items()))
+        self.assertTrue(any(op.name == 'SETITEMS'
+                            for op, arg, pos in pickletools.genops(data)))
+        copy = pickle.loads(data)
+        self.assertIs(type(copy), lg.LegoColour)
+        self.assertEqual(copy, c)
+
+    def test_pack_ints(self):
+        for values, code in (([], 'b'), ([1, -128, 127], 'b'),
+                             ([128], 'h'), ([-2 ** 31], 'i'),
+                             ([2 ** 40], 'q')):
+            data = lg.pack_ints(values)
+            self.assertEqual(chr(data[0]), code)
+            self.assertEqual(list(lg.unpack_ints(data)), values)
+
+
+class MigrationTest(TempDirTestCase):
+
+    def write_old_shelf(self, shelf_class, records):
+        '''
+        # writes the dbm file of shelf_class with records <key : record>
+        # pickled as dictionaries
+        '''
+        os.mkdir(lconf.shelves_dir)
+        old = shelve.open(shelf_class.file_name, flag='n')
+        for key, record in records.items():
+            old.dict[key.encode('utf-8')] = \
+                dict_pickle(type(record), dict(record.items()))
+        old.close()
+
+    def test_migrate(self):
+        records = {'4': colour(), '15': lg.LegoColour(15, 'White', 'FFFFFF',
+                                                      False)}
+        self.write_old_shelf(lg.LegoColourShelf, records)
+
+        lcs = lg.LegoColourShelf()
+        self.assertFalse(lcs.needs_migration())
+        self.assertEqual(sorted(lcs.keys()), ['15', '4'])
+        for key, record in records.items():
+            self.assertEqual(lcs[key], record)
+            data = lcs.shelf.dict[key.encode('utf-8')]
+            self.assertFalse(any(op.name in ('SETITEM', 'SETITEMS') for
+                                 op, arg, pos in pickletools.genops(data)))
+        lcs.close()
+
+        # the migrated shelf is opened as is
+
+        lcs = lg.LegoColourShelf()
+        self.assertFalse(lcs.needs_migration())
+        self.assertEqual(lcs['4'], records['4'])
+        lcs.close()
+
+    def test_migrate_sets(self):
+        ls = lego_set()
+        self.write_old_shelf(lg.LegoSetShelf, {ls.get_num(): ls})
+        lss = lg.LegoSetShelf()
+        self.assertEqual(lss[ls.get_num()], ls)
+        self.assertEqual(lss[ls.get_num()].get_elements(),
+                         ls.get_elements())
+        lss.close()
+
+    def test_empty_shelf_needs_no_migration(self):
+        lcs = lg.LegoColourShelf()
+        self.assertFalse(lcs.needs_migration())
+        lcs.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+
+# tests/test_rebrickable_cache.py
+#
+# ResponseCache: TTL, revalidation headers, LRU eviction and persistence,
+# and its use by Rebrickable._get with a fake session
+
+import json
+import os
+import unittest
+
+import requests
+
+from tests import TempDirTestCase
+
+import lego_conf as lconf
+import rebrickable as rb
+import rebrickable_cache as rbcache
+
+rb.debug = 0
+rbcache.debug = 0
+
+endpoint = 'lego/colors'
+url = 'https://rebrickable.com/api/v3/lego/colors/'
+
+
+class Response:
+    """
+    # stands in for a requests response
+    """
+
+    def __init__(self, status_code=200, data=None, headers=None):
+        self.status_code = status_code
+        self.content = json.dumps(data).encode('utf-8')
+        self.headers = headers or {}
+
+    def json(self):
+        return json.loads(self.content.decode('utf-8'))
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError(str(self.status_code),
+                                                response=self)
+
+
+class CacheTestCase(TempDirTestCase):
+
+    def setUp(self):
+        TempDirTestCase.setUp(self)
+        self.conf = (dict(lconf.cache_ttl), lconf.cache_max_bytes)
+
+    def tearDown(self):
+        lconf.cache_ttl, lconf.cache_max_bytes = self.conf
+        TempDirTestCase.tearDown(self)
+
+    def expire(self, cache, params=None):
+        cache.index[cache.key(url, params)]['stored'] -= \
+            lconf.cache_ttl[endpoint] + 1
+
+
+class ResponseCacheTest(CacheTestCase):
+
+    def test_fresh_and_stale(self):
+        cache = rbcache.ResponseCache()
+        self.assertEqual(cache.lookup(endpoint, url), (None, False))
+        cache.store(endpoint, url, None, Response(data={'results': [1]}))
+        entry, fresh = cache.lookup(endpoint, url)
+        self.assertTrue(fresh)
+        self.assertEqual(cache.response(entry).json(), {'results': [1]})
+        self.expire(cache)
+        entry, fresh = cache.lookup(endpoint, url)
+        self.assertIsNotNone(entry)
+        self.assertFalse(fresh)
+
+    def test_params_are_part_of_the_key(self):
+        cache = rbcache.ResponseCache()
+        cache.store(endpoint, url, {'page': 1, 'page_size': 10},
+                    Response(data=1))
+        self.assertTrue(cache.lookup(endpoint, url,
+                                     {'page_size': 10, 'page': 1})[1])
+        self.assertIsNone(cache.lookup(endpoint, url, {'page': 2})[0])
+
+    def test_not_cached(self):
+        cache = rbcache.ResponseCache()
+        cache.store('users/setlists', url, None, Response(data=1))
+        cache.store(endpoint, url, None, Response(404, data=1))
+        self.assertEqual(cache.index, {})
+        self.assertEqual(cache.lookup('users/setlists', url), (None, False))
+
+    def test_conditional_headers(self):
+        cache = rbcache.ResponseCache()
+        self.assertEqual(cache.conditional_headers(None), {})
+        cache.store(endpoint, url, None, Response(
+                data=1, headers={'ETag': '"abc"',
+                                 'Last-Modified': 'Mon, 1 Jan 2024'}))
+        entry, fresh = cache.lookup(endpoint, url)
+        self.assertEqual(cache.conditional_headers(entry),
+                         {'If-None-Match': '"abc"',
+                          'If-Modified-Since': 'Mon, 1 Jan 2024'})
+
+    def test_revalidated_entry_is_fresh_again(self):
+        cache = rbcache.ResponseCache()
+        cache.store(endpoint, url, None, Response(data=1))
+        self.expire(cache)
+        entry, fresh = cache.lookup(endpoint, url)
+        cache.response(entry)
+        self.assertFalse(cache.lookup(endpoint, url)[1])
+        cache.response(entry, revalidated=True)
+        self.assertTrue(cache.lookup(endpoint, url)[1])
+
+    def test_same_body_stored_once(self):
+        cache = rbcache.ResponseCache()
+        for page in (1, 2):
+            cache.store(endpoint, url, {'page': page}, Response(data=[]))
+        blobs = [f for f in os.listdir(lconf.cache_dir)
+                 if f != cache.index_file]
+        self.assertEqual(len(blobs), 1)
+
+    def test_missing_blob(self):
+        cache = rbcache.ResponseCache()
+        cache.store(endpoint, url, None, Response(data=1))
+        entry, fresh = cache.lookup(endpoint, url)
+        os.unlink(os.path.join(lconf.cache_dir, entry['blob']))
+        self.assertEqual(cache.lookup(endpoint, url), (None, False))
+
+    def test_evict_least_recently_used(self):
+        cache = rbcache.ResponseCache()
+        for page in (1, 2, 3):
+            cache.store(endpoint, url, {'page': page},
+                        Response(data='x' * 100 + str(page)))
+        for page, used in ((1, 300), (2, 100), (3, 200)):
+            cache.index[cache.key(url, {'page': page})]['used'] = used
+        size = cache.index[cache.key(url, {'page': 1})]['size']
+        lconf.cache_max_bytes = 2 * size
+        cache.evict()
+        self.assertIsNone(cache.lookup(endpoint, url, {'page': 2})[0])
+        self.assertIsNotNone(cache.lookup(endpoint, url, {'page': 1})[0])
+        self.assertIsNotNone(cache.lookup(endpoint, url, {'page': 3})[0])
+        self.assertEqual(len(os.listdir(lconf.cache_dir)), 2)
+
+    def test_save_and_reload(self):
+        cache = rbcache.ResponseCache()
+        cache.store(endpoint, url, None, Response(data={'a': 1}))
+        cache.save()
+        self.assertFalse(cache.modified)
+        cache = rbcache.ResponseCache()
+        entry, fresh = cache.lookup(endpoint, url)
+        self.assertTrue(fresh)
+        self.assertEqual(cache.response(entry).json(), {'a': 1})
+
+
+class RebrickableGetTest(CacheTestCase):
+    """
+    # Rebrickable._get with the session answering with self.answers, one
+    # per request (a response or an exception to raise)
+    """
+
+    def setUp(self):
+        CacheTestCase.setUp(self)
+        self.conf_retries = (rb.limiter, lconf.max_retries,
+                             lconf.retry_backoff)
+        rb.limiter = rb.TokenBucket(1000, 100)
+        lconf.max_retries = 1
+        lconf.retry_backoff = 0.001
+        self.reb = rb.Rebrickable()
+        self.reb.session.get = self.get
+        self.answers = []
+        self.requests = []
+
+    def tearDown(self):
+        rb.limiter, lconf.max_retries, lconf.retry_backoff = \
+            self.conf_retries
+        CacheTestCase.tearDown(self)
+
+    def get(self, url, params=None, headers=None, timeout=None):
+        self.requests.append(headers)
+        answer = self.answers.pop(0)
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+
+    def stale(self):
+        '''
+        # caches a response to url and expires it
+        '''
+        self.answers = [Response(data={'n': 1}, headers={'ETag': '"v1"'})]
+        self.reb._get(endpoint, url)
+        self.expire(self.reb.cache)
+        self.requests = []
+
+    def test_fresh_hit(self):
+        self.answers = [Response(data={'n': 1})]
+        self.reb._get(endpoint, url)
+        self.assertEqual(self.reb._get(endpoint, url).json(), {'n': 1})
+        self.assertEqual(len(self.requests), 1)
+        self.assertEqual(self.reb.stats[endpoint]['cache_hits'], 1)
+
+    def test_not_modified(self):
+        self.stale()
+        self.answers = [Response(304)]
+        self.assertEqual(self.reb._get(endpoint, url).json(), {'n': 1})
+        self.assertEqual(self.requests[0]['If-None-Match'], '"v1"')
+        self.assertTrue(self.reb.cache.lookup(endpoint, url)[1])
+
+    def test_modified(self):
+        self.stale()
+        self.answers = [Response(data={'n': 2})]
+        self.assertEqual(self.reb._get(endpoint, url).json(), {'n': 2})
+        self.assertEqual(self.reb._get(endpoint, url).json(), {'n': 2})
+        self.assertEqual(len(self.requests), 1)
+
+    def test_stale_when_unreachable(self):
+        for error in (requests.exceptions.ConnectionError(),
+                      requests.exceptions.Timeout(),
+                      Response(503)):
+            self.stale()
+            self.answers = [error, error]
+            self.assertEqual(self.reb._get(endpoint, url).json(), {'n': 1})
+            self.assertEqual(len(self.requests), 2)     # with the retry
+
+    def test_client_error_is_raised(self):
+        for status in (401, 404):
+            self.stale()
+            self.answers = [Response(status)]
+            with self.assertRaises(requests.exceptions.HTTPError):
+                self.reb._get(endpoint, url)
+
+    def test_error_without_cache_is_raised(self):
+        self.answers = [requests.exceptions.ConnectionError()] * 2
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            self.reb._get(endpoint, url)
+
+    def test_api_key_only_sent_to_the_api(self):
+        self.answers = [Response(data=1), Response(data=1)]
+        self.reb._get(endpoint, url)
+        self.reb._get('img', 'https://cdn.rebrickable.com/a.jpg',
+                      throttle=False)
+        self.assertIn('Authorization', self.requests[0])
+        self.assertNotIn('Authorization', self.requests[1] or {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+
+# tests/test_rebrickable_journal.py
+#
+# FetchJournal: the records of a run, reloaded on resume, a truncated last
+# record and the pages fetched with another page size
+
+import os
+import unittest
+
+from tests import TempDirTestCase
+
+import lego_conf as lconf
+import rebrickable_journal as rbjournal
+
+rbjournal.debug = 0
+
+
+class FetchJournalTest(TempDirTestCase):
+
+    file_name = 'shelves/fetch.journal'
+
+    def setUp(self):
+        TempDirTestCase.setUp(self)
+        self.page_size = lconf.page_size
+
+    def tearDown(self):
+        lconf.page_size = self.page_size
+        TempDirTestCase.tearDown(self)
+
+    def interrupted_run(self):
+        '''
+        # journal of a run interrupted while fetching the second set
+        '''
+        j = rbjournal.FetchJournal(self.file_name)
+        j.phase_done('colours')
+        j.phase_done('themes')
+        j.start({'1-1': 1, '2-1': 2})
+        j.set_fetched('1-1', {'set_num': '1-1'})
+        j.page_fetched('1-1', 1, [{'id': 1}])
+        j.page_fetched('1-1', 2, [{'id': 2}])
+        j.set_done('1-1')
+        j.set_fetched('2-1', {'set_num': '2-1'})
+        j.page_fetched('2-1', 1, [{'id': 3}])
+        j.close()
+
+    def test_resume(self):
+        self.interrupted_run()
+        j = rbjournal.FetchJournal(self.file_name, resume=True)
+        self.assertTrue(j.resumed)
+        self.assertEqual(j.phases, {'colours', 'themes'})
+        self.assertEqual(j.set_list, {'1-1': 1, '2-1': 2})
+        self.assertEqual(j.fetched('1-1'),
+                         ({'set_num': '1-1'}, [[{'id': 1}], [{'id': 2}]],
+                          True))
+        self.assertEqual(j.fetched('2-1'),
+                         ({'set_num': '2-1'}, [[{'id': 3}]], False))
+        # each set is only given once
+        self.assertEqual(j.fetched('2-1'), (None, [], False))
+        j.close()
+
+    def test_resume_appends(self):
+        self.interrupted_run()
+        j = rbjournal.FetchJournal(self.file_name, resume=True)
+        j.page_fetched('2-1', 2, [{'id': 4}])
+        j.set_done('2-1')
+        j.close()
+        j = rbjournal.FetchJournal(self.file_name, resume=True)
+        self.assertEqual(j.phases, {'colours', 'themes'})
+        self.assertEqual(j.fetched('2-1'),
+                         ({'set_num': '2-1'}, [[{'id': 3}], [{'id': 4}]],
+                          True))
+        j.close()
+
+    def test_no_resume_starts_empty(self):
+        self.interrupted_run()
+        j = rbjournal.FetchJournal(self.file_name)
+        self.assertFalse(j.resumed)
+        self.assertEqual(j.phases, set())
+        self.assertIsNone(j.set_list)
+        j.close()
+        self.assertEqual(os.path.getsize(self.file_name), 0)
+
+    def test_resume_without_journal(self):
+        j = rbjournal.FetchJournal(self.file_name, resume=True)
+        self.assertFalse(j.resumed)
+        j.close()
+
+    def test_truncated_record(self):
+        self.interrupted_run()
+        size = os.path.getsize(self.file_name)
+        with open(self.file_name, 'a') as f:
+            f.write('{"set":"2-1","page":2,"lines":[{"id"')
+        j = rbjournal.FetchJournal(self.file_name, resume=True)
+        self.assertEqual(os.path.getsize(self.file_name), size)
+        self.assertEqual(j.fetched('2-1')[1], [[{'id': 3}]])
+
+        # the records written after it are not lost behind the broken line
+
+        j.set_done('2-1')
+        j.close()
+        j = rbjournal.FetchJournal(self.file_name, resume=True)
+        self.assertEqual(j.fetched('2-1')[2], True)
+        j.close()
+
+    def test_record_without_newline(self):
+        self.interrupted_run()
+        with open(self.file_name, 'a') as f:
+            f.write('{"phase":"part_categories"}')
+        j = rbjournal.FetchJournal(self.file_name, resume=True)
+        self.assertNotIn('part_categories', j.phases)
+        j.close()
+
+    def test_pages_out_of_order(self):
+        j = rbjournal.FetchJournal(self.file_name)
+        j.start({'1-1': 1})
+        j.page_fetched('1-1', 1, [{'id': 1}])
+        j.page_fetched('1-1', 3, [{'id': 3}])
+        j.close()
+        j = rbjournal.FetchJournal(self.file_name, resume=True)
+        self.assertEqual(j.fetched('1-1')[1], [[{'id': 1}]])
+        j.close()
+
+    def test_page_size_changed(self):
+        self.interrupted_run()
+        lconf.page_size = self.page_size + 1
+        j = rbjournal.FetchJournal(self.file_name, resume=True)
+        # the pages of the set done are kept, those of the other one dropped
+        self.assertEqual(len(j.fetched('1-1')[1]), 2)
+        self.assertEqual(j.fetched('2-1'), ({'set_num': '2-1'}, [], False))
+        j.close()
+
+    def test_no_file(self):
+        j = rbjournal.FetchJournal(None)
+        j.phase_done('colours')
+        j.start({'1-1': 1})
+        self.assertEqual(j.phases, {'colours'})
+        j.remove()
+        self.assertEqual(os.listdir('.'), [])
+
+    def test_remove(self):
+        self.interrupted_run()
+        j = rbjournal.FetchJournal(self.file_name, resume=True)
+        j.remove()
+        self.assertFalse(os.path.exists(self.file_name))
+
+
+if __name__ == '__main__':
+    unittest.main()